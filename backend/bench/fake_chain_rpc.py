@@ -0,0 +1,143 @@
+"""Local stand-in for a chain's Tendermint RPC, answering the JSON-RPC ``tx`` method.
+
+Knows only the txs registered with add_grant/add_delegation/add_failed or
+loaded from a fixtures file; every other hash gets the node's "not found"
+error. Single calls and batches are both accepted. Point a validator's rpcUrl
+at it (through VALIDATORS_CONFIG) to exercise services.tx_verifier locally.
+
+Run standalone with ``python -m bench.fake_chain_rpc --port 26657 --fixtures txs.json``,
+where the fixtures file maps tx hashes to ``{"code": 0, "events": [...], "memo": "..."}``.
+"""
+import json
+import base64
+import asyncio
+import argparse
+from collections import Counter
+from aiohttp import web
+
+
+def _length_delimited(number: int, value: bytes) -> bytes:
+    length, prefix = len(value), bytearray()
+    while True:
+        prefix.append((length & 0x7f) | (0x80 if length > 0x7f else 0))
+        length >>= 7
+        if not length:
+            break
+    return bytes([number << 3 | 2]) + bytes(prefix) + value
+
+
+def encode_tx(memo: str) -> str:
+    """Base64 TxRaw whose body carries only the memo, enough for the verifier to read it."""
+    body = _length_delimited(2, memo.encode())
+    return base64.b64encode(_length_delimited(1, body)).decode()
+
+
+class FakeChainRPC:
+    def __init__(self, host: str = "127.0.0.1", port: int = 26657, latency: float = 0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.txs = {}
+        self.calls = Counter()
+        self._height = 1000
+        self._runner = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def add_tx(self, tx_hash: str, code: int = 0, events: list = None, log: str = "", memo: str = ""):
+        self._height += 1
+        self.txs[tx_hash.upper()] = {
+            "hash": tx_hash.upper(),
+            "height": str(self._height),
+            "index": 0,
+            "tx_result": {"code": code, "log": log, "events": events or []},
+            "tx": encode_tx(memo),
+        }
+
+    def add_grant(self, tx_hash: str, granter: str, grantee: str, memo: str = ""):
+        self.add_tx(tx_hash, memo=memo, events=[{
+            "type": "cosmos.authz.v1beta1.EventGrant",
+            "attributes": [
+                {"key": "granter", "value": json.dumps(granter), "index": True},
+                {"key": "grantee", "value": json.dumps(grantee), "index": True},
+                {"key": "msg_type_url", "value": json.dumps("/cosmos.staking.v1beta1.MsgDelegate"), "index": True},
+            ],
+        }])
+
+    def add_delegation(self, tx_hash: str, delegator: str, validator: str, amount: str, memo: str = ""):
+        self.add_tx(tx_hash, memo=memo, events=[{
+            "type": "delegate",
+            "attributes": [
+                {"key": "validator", "value": validator, "index": True},
+                {"key": "delegator", "value": delegator, "index": True},
+                {"key": "amount", "value": amount, "index": True},
+            ],
+        }])
+
+    def add_failed(self, tx_hash: str, code: int = 5, log: str = "insufficient funds"):
+        self.add_tx(tx_hash, code=code, log=log)
+
+    def answer(self, request: dict) -> dict:
+        self.calls[request.get("method")] += 1
+        answer = {"jsonrpc": "2.0", "id": request.get("id")}
+        if request.get("method") != "tx":
+            answer["error"] = {"code": -32601, "message": "Method not found"}
+            return answer
+        try:
+            tx_hash = base64.b64decode(request["params"]["hash"]).hex().upper()
+        except (KeyError, TypeError, ValueError):
+            answer["error"] = {"code": -32602, "message": "Invalid params"}
+            return answer
+        if tx_hash in self.txs:
+            answer["result"] = self.txs[tx_hash]
+        else:
+            answer["error"] = {"code": -32603, "message": "Internal error", "data": f"tx ({tx_hash}) not found"}
+        return answer
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        body = await request.json()
+        self.calls["http"] += 1
+        if isinstance(body, list):
+            return web.json_response([self.answer(item) for item in body])
+        return web.json_response(self.answer(body))
+
+
+async def main(host: str, port: int, latency: float, fixtures: str):
+    server = FakeChainRPC(host, port, latency)
+    if fixtures:
+        with open(fixtures, "r", encoding="utf-8") as f:
+            for tx_hash, tx in json.load(f).items():
+                server.add_tx(tx_hash, code=tx.get("code", 0), events=tx.get("events"), log=tx.get("log", ""),
+                              memo=tx.get("memo", ""))
+    await server.start()
+    print(f"Fake chain RPC listening on {server.url} with {len(server.txs)} txs")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Tendermint RPC server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=26657)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before each answer")
+    parser.add_argument("--fixtures", help="JSON file mapping tx hashes to {code, events, log, memo}")
+    args = parser.parse_args()
+    asyncio.run(main(args.host, args.port, args.latency, args.fixtures))
@@ -0,0 +1,99 @@
+"""Local stand-in for the Telegram Bot API used by the benchmarks.
+
+Answers every ``/bot<token>/<method>`` call with a minimal successful result,
+optionally after a fixed delay, and counts calls per method. Point the
+backend at it with ``TG_API_URL=http://<host>:<port>``.
+
+Run standalone with ``python -m bench.fake_telegram --port 8081``.
+"""
+import time
+import asyncio
+import argparse
+from collections import Counter
+from aiohttp import web
+
+
+def chat_id_of(params: dict) -> int:
+    try:
+        return int(params.get("chat_id"))
+    except (TypeError, ValueError):
+        return 0
+
+
+class FakeTelegramServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 8081, latency: float = 0.0, poll_timeout: float = 1.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.poll_timeout = poll_timeout
+        self.calls = Counter()
+        self._message_id = 0
+        self._runner = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        params = dict(request.query)
+        if request.can_read_body:
+            if request.content_type == "application/json":
+                params.update(await request.json())
+            else:
+                params.update(await request.post())
+
+        if method.lower() == "getupdates":
+            await asyncio.sleep(min(float(params.get("timeout", 0) or 0), self.poll_timeout))
+            return web.json_response({"ok": True, "result": []})
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.json_response({"ok": True, "result": self.result(method.lower(), params)})
+
+    def result(self, method: str, params: dict):
+        if method == "getme":
+            return {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if method == "getchat":
+            chat_id = chat_id_of(params)
+            return {"id": chat_id, "type": "private", "username": f"user{chat_id}"}
+        if method in ("sendmessage", "forwardmessage"):
+            self._message_id += 1
+            return {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id_of(params), "type": "private"},
+                "text": params.get("text", ""),
+            }
+        return True
+
+
+async def main(host: str, port: int, latency: float):
+    server = FakeTelegramServer(host, port, latency)
+    await server.start()
+    print(f"Fake Telegram Bot API listening on {server.url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before each answer")
+    args = parser.parse_args()
+    asyncio.run(main(args.host, args.port, args.latency))
@@ -0,0 +1,60 @@
+"""Synthetic users and links for the benchmarks.
+
+Benchmark users get numeric telegram ids starting at BENCH_ID_BASE so they
+never collide with real ones and can be removed with clear_bench_data().
+"""
+from datetime import datetime, timedelta, timezone
+from tortoise import Tortoise
+from models.models import Developers, Users, UniqueLinks, Delegations, DelegationTxs, ReferralAncestry, ReferralStats
+from services.link_tokens import issue_link_token
+
+BENCH_ID_BASE = 900000000000
+BENCH_ID_PREFIX = "9000000"
+BENCH_DEV_CODE = "bench-dev"
+
+
+def bench_telegram_id(index: int) -> str:
+    return str(BENCH_ID_BASE + index)
+
+
+async def init_db(db_url: str):
+    await Tortoise.init(db_url=db_url, modules={'models': ['models.models']})
+    await Tortoise.generate_schemas(safe=True)
+
+
+async def clear_bench_data():
+    await UniqueLinks.filter(telegram_id__startswith=BENCH_ID_PREFIX).delete()
+    await Delegations.filter(telegram_id__startswith=BENCH_ID_PREFIX).delete()
+    await DelegationTxs.filter(telegram_id__startswith=BENCH_ID_PREFIX).delete()
+    await ReferralAncestry.filter(descendant_id__startswith=BENCH_ID_PREFIX).delete()
+    await ReferralStats.filter(referrer_id__startswith=BENCH_ID_PREFIX).delete()
+    await ReferralStats.filter(referrer_id=BENCH_DEV_CODE).delete()
+    await Users.filter(telegram_id__startswith=BENCH_ID_PREFIX).delete()
+    await Developers.filter(referral_dev_code=BENCH_DEV_CODE).delete()
+
+
+async def seed_users(count: int, links_per_user: int, batch_size: int = 1000) -> dict:
+    """Create developer-referred users that already chose a language, each with unused links.
+
+    Returns a mapping of telegram_id to its signed link tokens.
+    """
+    await clear_bench_data()
+    await Developers.create(referral_dev_code=BENCH_DEV_CODE)
+    expires_at = datetime.now(timezone.utc) + timedelta(days=1)
+    links = {}
+    for start in range(0, count, batch_size):
+        users = [
+            Users(telegram_id=bench_telegram_id(i), username=f"bench{i}", firstname="Bench",
+                  ref_id=BENCH_DEV_CODE, ref_type="developer", ref_level=1, language="en")
+            for i in range(start, min(start + batch_size, count))
+        ]
+        await Users.bulk_create(users)
+        user_links = []
+        for user in users:
+            tokens = [issue_link_token(user.telegram_id, BENCH_DEV_CODE, expires_at.timestamp())
+                      for _ in range(links_per_user)]
+            links[user.telegram_id] = [token for token, _ in tokens]
+            user_links += [UniqueLinks(link_id=nonce, telegram_id=user.telegram_id, expires_at=expires_at)
+                           for _, nonce in tokens]
+        await UniqueLinks.bulk_create(user_links, batch_size=batch_size)
+    return links
@@ -0,0 +1,25 @@
+"""Latency summaries shared by the benchmarks."""
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies: list, duration: float, errors: int = 0) -> dict:
+    latencies = sorted(latencies)
+    total = len(latencies) + errors
+    return {
+        "requests": total,
+        "errors": errors,
+        "duration_s": round(duration, 3),
+        "rps": round(total / duration, 1) if duration else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50) * 1000, 2),
+            "p95": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99": round(percentile(latencies, 0.99) * 1000, 2),
+            "max": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        },
+    }
@@ -0,0 +1,92 @@
+import os
+import json
+import asyncio
+import logging
+from string import Formatter
+
+logger = logging.getLogger(__name__)
+
+LOCALES_PATH = os.getenv('LOCALES_PATH', 'local/locales.json')
+LOCALES_RELOAD_INTERVAL = float(os.getenv('LOCALES_RELOAD_INTERVAL', '5'))
+DEFAULT_LANG = 'en'
+
+
+def compile_message(text: str):
+    if any(field is not None for _, field, _, _ in Formatter().parse(text)):
+        return text.format
+    return lambda **kwargs: text
+
+
+class LocaleBundle:
+    """Per-language message formatters with the English fallback already applied.
+
+    Keys missing from a language are reported once, when the bundle is built.
+    """
+
+    def __init__(self, messages: dict, default_lang: str = DEFAULT_LANG):
+        default = messages.get(default_lang, {})
+        keys = set().union(*(texts.keys() for texts in messages.values()))
+        self.languages = {}
+        for lang, texts in messages.items():
+            compiled = {}
+            for key in keys:
+                text = texts.get(key)
+                if not text:
+                    text = default.get(key)
+                    logger.warning(f"Message key '{key}' not found for language '{lang}'. Falling back to English.")
+                if text:
+                    compiled[key] = compile_message(text)
+            self.languages[lang] = compiled
+        self.default = self.languages.get(default_lang, {})
+
+    def get(self, key: str, lang: str, **kwargs) -> str:
+        formatter = self.languages.get(lang, self.default).get(key)
+        if formatter is None:
+            return f"Message key '{key}' not found."
+        return formatter(**kwargs)
+
+
+_bundle = None
+_mtime = None
+
+
+def load_locales(path: str = LOCALES_PATH) -> LocaleBundle:
+    global _bundle, _mtime
+    mtime = os.stat(path).st_mtime
+    with open(path, 'r', encoding='utf-8') as f:
+        bundle = LocaleBundle(json.load(f))
+    _bundle, _mtime = bundle, mtime
+    logger.info(f"Loaded locales from {path}: {', '.join(bundle.languages)}")
+    return bundle
+
+
+def get_bundle() -> LocaleBundle:
+    """The loaded bundle; the locales file is read on first use rather than at import."""
+    return _bundle or load_locales()
+
+
+def get_message(key: str, lang: str, **kwargs) -> str:
+    return get_bundle().get(key, lang, **kwargs)
+
+
+async def watch_locales(path: str = LOCALES_PATH, interval: float = LOCALES_RELOAD_INTERVAL):
+    """Reload the bundle whenever the locales file changes.
+
+    A file that fails to parse is reported and the previous bundle stays in use.
+    Nothing is read until the bundle has been loaded once.
+    """
+    global _mtime
+    while True:
+        await asyncio.sleep(interval)
+        if _bundle is None:
+            continue
+        mtime = _mtime
+        try:
+            mtime = os.stat(path).st_mtime
+            if mtime == _mtime:
+                continue
+            load_locales(path)
+        except Exception as e:
+            _mtime = mtime
+            logger.error(f"Error reloading locales from {path}: {e}")
+
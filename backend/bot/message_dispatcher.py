@@ -0,0 +1,195 @@
+import os
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from collections import deque
+from functools import partial
+from aiogram.exceptions import TelegramRetryAfter, TelegramNetworkError
+from services.metrics import TELEGRAM_SEND_DURATION, TELEGRAM_SEND_ERRORS
+
+logger = logging.getLogger(__name__)
+
+TG_SEND_WORKERS = int(os.getenv('TG_SEND_WORKERS', '4'))
+TG_SEND_QUEUE_SIZE = int(os.getenv('TG_SEND_QUEUE_SIZE', '1000'))
+TG_SEND_RETRIES = int(os.getenv('TG_SEND_RETRIES', '3'))
+TG_GLOBAL_RATE = float(os.getenv('TG_GLOBAL_RATE', '30'))
+TG_CHAT_RATE = float(os.getenv('TG_CHAT_RATE', '1'))
+TG_DRAIN_TIMEOUT = float(os.getenv('TG_DRAIN_TIMEOUT', '10'))
+
+
+class MessageDispatcher:
+    """Sends outgoing Telegram requests from a worker pool under a global and a per-chat rate limit.
+
+    Jobs wait in a queue per chat, and chats with waiting jobs sit in a heap
+    keyed by the time their next slot opens. Workers always take the chat
+    that is ready first instead of sleeping on one chat's slot, so a burst to
+    one chat does not hold up the others. A chat has at most one job in
+    flight, so its messages keep their order. Flood-control errors pause
+    every worker for the time Telegram asks for and the job is retried.
+    """
+
+    def __init__(self, workers=TG_SEND_WORKERS, maxsize=TG_SEND_QUEUE_SIZE, global_rate=TG_GLOBAL_RATE,
+                 chat_rate=TG_CHAT_RATE, retries=TG_SEND_RETRIES):
+        self.workers_count = workers
+        self.global_interval = 1 / global_rate
+        self.chat_interval = 1 / chat_rate
+        self.retries = retries
+        self.workers = []
+        self.depth = 0
+        self._capacity = asyncio.Semaphore(maxsize)
+        self._chats = {}
+        self._ready = []
+        self._order = itertools.count()
+        self._changed = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._global_next = 0.0
+        self._chat_next = {}
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.submit_wait = 0.0
+        self.rate_wait = 0.0
+
+    @property
+    def running(self) -> bool:
+        return any(not worker.done() for worker in self.workers)
+
+    def start(self):
+        if not self.running:
+            self.workers = [asyncio.create_task(self._run()) for _ in range(self.workers_count)]
+            logger.info(f"Message dispatcher started with {self.workers_count} workers.")
+
+    async def submit(self, chat_id, request):
+        """Queue a zero-argument coroutine factory that performs one request to chat_id."""
+        if not self.running:
+            return await request()
+        chat_id = str(chat_id)
+        started = time.perf_counter()
+        await self._capacity.acquire()
+        self.submit_wait += time.perf_counter() - started
+        self.depth += 1
+        self._idle.clear()
+        jobs = self._chats.get(chat_id)
+        if jobs is None:
+            jobs = self._chats[chat_id] = deque()
+            self._schedule(chat_id)
+        jobs.append(request)
+
+    async def stop(self, timeout: float = TG_DRAIN_TIMEOUT):
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Message dispatcher drain timed out, {self.depth} messages were not sent.")
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "queue_depth": self.depth,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "submit_wait_s": round(self.submit_wait, 3),
+            "rate_wait_s": round(self.rate_wait, 3),
+        }
+
+    async def _run(self):
+        while True:
+            chat_id, request = await self._next_job()
+            try:
+                await self._send(chat_id, request)
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Error sending message to chat {chat_id}: {e}")
+            finally:
+                self._job_done(chat_id)
+
+    def _schedule(self, chat_id):
+        heapq.heappush(self._ready, (self._chat_next.get(chat_id, 0.0), next(self._order), chat_id))
+        self._changed.set()
+
+    async def _next_job(self):
+        """Take the first job of the chat whose slot opens first, waiting only until some chat is ready."""
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            if self._ready and self._ready[0][0] <= now:
+                _, _, chat_id = heapq.heappop(self._ready)
+                self._chat_next[chat_id] = now + self.chat_interval
+                if len(self._chat_next) > 10000:
+                    self._chat_next = {chat: t for chat, t in self._chat_next.items() if t > now}
+                return chat_id, self._chats[chat_id].popleft()
+            self._changed.clear()
+            timeout = self._ready[0][0] - now if self._ready else None
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _job_done(self, chat_id):
+        self.depth -= 1
+        self._capacity.release()
+        if self._chats[chat_id]:
+            self._schedule(chat_id)
+        else:
+            del self._chats[chat_id]
+        if not self.depth:
+            self._idle.set()
+
+    async def _send(self, chat_id, request):
+        for attempt in range(self.retries + 1):
+            await self._wait_for_global()
+            try:
+                await self._request(request)
+                self.sent += 1
+                return
+            except TelegramRetryAfter as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning(f"Flood control for chat {chat_id}, retrying in {e.retry_after}s.")
+                self.retried += 1
+                loop = asyncio.get_running_loop()
+                self._global_next = max(self._global_next, loop.time() + e.retry_after)
+            except TelegramNetworkError as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning(f"Network error sending to chat {chat_id}: {e}, retrying.")
+                self.retried += 1
+                await asyncio.sleep(2 ** attempt)
+
+    async def _request(self, request):
+        started = time.perf_counter()
+        try:
+            return await request()
+        except Exception as e:
+            TELEGRAM_SEND_ERRORS.labels(type(e).__name__).inc()
+            raise
+        finally:
+            TELEGRAM_SEND_DURATION.observe(time.perf_counter() - started)
+
+    async def _wait_for_global(self):
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self._global_next)
+        self._global_next = slot + self.global_interval
+        if slot > now:
+            self.rate_wait += slot - now
+            await asyncio.sleep(slot - now)
+
+
+message_dispatcher = MessageDispatcher()
+
+
+async def send_message(bot, chat_id, text: str, **kwargs):
+    await message_dispatcher.submit(chat_id, partial(bot.send_message, chat_id=chat_id, text=text, **kwargs))
+
+
+async def forward_message(message, chat_id):
+    await message_dispatcher.submit(chat_id, partial(message.forward, chat_id=chat_id))
@@ -1,29 +1,64 @@
 import logging
 import os
-import uuid
-import json
+import asyncio
+from datetime import datetime, timezone
+from functools import lru_cache
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import Command, CommandStart
-from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, Update
 from aiogram.dispatcher.router import Router
 from aiogram.filters.callback_data import CallbackData
+from tortoise.transactions import in_transaction
 
 from models.models import Developers, Users
 from services.encode_decode_id import encode_id
+from services.referral_ancestry import attach_referral
+from services.referral_stats import record_links
+from services.unique_links import create_unique_link, UNIQUE_LINK_TTL
+from services.link_tokens import issue_link_token
+from services.developer_codes import is_developer_code, add_developer_code
+from services.user_cache import user_cache
+from bot.message_dispatcher import send_message, forward_message
+from bot.locales import get_message
+from services.metrics import HandlerMetricsMiddleware
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-bot = Bot(token=os.getenv('TG_BOT_TOKEN'))
+tg_api_url = os.getenv('TG_API_URL')
+
+_bot = None
+
+
+def get_bot() -> Bot:
+    """The Bot instance, created on first use so importing this module needs no token or session."""
+    global _bot
+    if _bot is None:
+        _bot = Bot(
+            token=os.getenv('TG_BOT_TOKEN'),
+            session=AiohttpSession(api=TelegramAPIServer.from_base(tg_api_url)) if tg_api_url else None,
+        )
+    return _bot
+
+
+def bot_created() -> bool:
+    return _bot is not None
+
+
 dp = Dispatcher()
 router = Router()
+router.message.middleware(HandlerMetricsMiddleware("message"))
+router.callback_query.middleware(HandlerMetricsMiddleware("callback_query"))
 
 allowed_user_id = os.getenv('ALLOWED_USER_ID')
 tg_bot_link = os.getenv('TG_BOT_LINK')
 website_link = os.getenv('WEBSITE_LINK')
 
-with open('local/locales.json', 'r', encoding='utf-8') as f:
-    MESSAGES = json.load(f)
+tg_bot_mode = os.getenv('TG_BOT_MODE', 'polling')
+tg_webhook_url = os.getenv('TG_WEBHOOK_URL')
+tg_webhook_path = os.getenv('TG_WEBHOOK_PATH', '/api/telegram/webhook')
+tg_webhook_secret = os.getenv('TG_WEBHOOK_SECRET')
 
 
 class LanguageCallback(CallbackData, prefix="set_lang"):
@@ -31,30 +66,37 @@ class LanguageCallback(CallbackData, prefix="set_lang"):
     ref_arg: str
 
 
-def get_message(key: str, lang: str, **kwargs):
-    messages_lang = MESSAGES.get(lang, MESSAGES['en'])
-    text = messages_lang.get(key)
-    if not text:
-        logger.warning(f"Message key '{key}' not found for language '{lang}'. Falling back to English.")
-        text = MESSAGES['en'].get(key, f"Message key '{key}' not found.")
-    return text.format(**kwargs)
+@lru_cache(maxsize=4096)
+def language_keyboard(ref_arg: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text="English",
+                callback_data=LanguageCallback(lang_code='en', ref_arg=ref_arg).pack()
+            ),
+            InlineKeyboardButton(
+                text="Русский",
+                callback_data=LanguageCallback(lang_code='ru', ref_arg=ref_arg).pack()
+            )
+        ]
+    ])
 
 
 async def generate_unique_link(user_id: str, ref_id: str, lang: str = 'en'):
-    unique_id = str(uuid.uuid4())
-    link = f"{website_link}?link_id={unique_id}&r_id={encode_id(ref_id)}&u_id={encode_id(user_id)}&lang={lang}"
-    return link, unique_id
+    expires_at = datetime.now(timezone.utc) + UNIQUE_LINK_TTL
+    token, unique_id = issue_link_token(user_id, ref_id, expires_at.timestamp())
+    link = f"{website_link}?link_id={token}&r_id={encode_id(ref_id)}&u_id={encode_id(user_id)}&lang={lang}"
+    return link, unique_id, expires_at
 
 
 async def send_new_link_to_user(user_id: str):
     try:
-        user = await Users.get_or_none(telegram_id=user_id)
+        user = await user_cache.get(user_id)
         if user:
             lang = user.language or 'en'
-            link, unique_id = await generate_unique_link(str(user_id), user.ref_id, lang=lang)
-            user.used_unique_links[unique_id] = False
+            link, unique_id, expires_at = await generate_unique_link(str(user_id), user.ref_id, lang=lang)
             try:
-                await user.save()
+                await create_unique_link(unique_id, str(user_id), expires_at=expires_at)
                 keyboard = InlineKeyboardMarkup(
                     inline_keyboard=[
                         [
@@ -65,15 +107,16 @@ async def send_new_link_to_user(user_id: str):
                         ]
                     ]
                 )
-                await bot.send_message(
+                await send_message(
+                    get_bot(),
                     chat_id=user_id,
                     text=get_message("new_one_time_link_text", lang),
                     reply_markup=keyboard
                 )
-                logger.info(f"Sent new link to user {user_id}")
+                logger.info("Queued new link for user %s", user_id)
             except Exception as e:
                 logger.error(
-                    f"Error with telegram_id {user_id} in send_new_link_to_user; user.save() with new link: {e}")
+                    f"Error with telegram_id {user_id} in send_new_link_to_user; saving new link: {e}")
         else:
             logger.error(f"User with telegram_id {user_id} not found.")
     except Exception as e:
@@ -89,35 +132,25 @@ async def cmd_start(message: Message):
     args = message.text.split()
     ref_arg = args[1] if len(args) > 1 else None
 
-    user = await Users.get_or_none(telegram_id=user_id)
+    user = await user_cache.get(user_id)
 
     if user:
         if user.ref_id != "None":
             lang = user.language or 'en'
-            link, unique_id = await generate_unique_link(user_id, user.ref_id, lang=lang)
-            user.used_unique_links[unique_id] = False
+            link, unique_id, expires_at = await generate_unique_link(user_id, user.ref_id, lang=lang)
             try:
-                await user.save()
-                await message.answer(get_message('your_one_time_link', lang, link=link))
+                await create_unique_link(unique_id, user_id, expires_at=expires_at)
+                await send_message(get_bot(), message.chat.id, get_message('your_one_time_link', lang, link=link))
                 ref_link = f"{tg_bot_link}?start={user_id}"
-                await message.answer(get_message('your_referral_link', lang, ref_link=ref_link))
+                await send_message(get_bot(), message.chat.id, get_message('your_referral_link', lang, ref_link=ref_link))
             except Exception as e:
                 logger.error(
-                    f"Error with telegram_id {user_id} in cmd_start; user.save() with new link after new start: {e}")
+                    f"Error with telegram_id {user_id} in cmd_start; saving new link after new start: {e}")
         else:
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [
-                    InlineKeyboardButton(
-                        text="English",
-                        callback_data=LanguageCallback(lang_code='en', ref_arg=ref_arg or '').pack()
-                    ),
-                    InlineKeyboardButton(
-                        text="Русский",
-                        callback_data=LanguageCallback(lang_code='ru', ref_arg=ref_arg or '').pack()
-                    )
-                ]
-            ])
-            await message.answer(
+            keyboard = language_keyboard(ref_arg or '')
+            await send_message(
+                get_bot(),
+                message.chat.id,
                 "Please choose your language / Пожалуйста, выберите ваш язык",
                 reply_markup=keyboard
             )
@@ -129,30 +162,21 @@ async def cmd_start(message: Message):
             "ref_id": ref_arg if ref_arg else "None",
             "ref_type": "None",
             "ref_level": 0,
-            "used_unique_links": {},
             "language": None
         }
         try:
             user = await Users.create(**user_data)
-            logger.info(f"Created new user with telegram_id {user_id} and ref_id {user.ref_id}")
+            user_cache.put(user)
+            logger.info("Created new user with telegram_id %s and ref_id %s", user_id, user.ref_id)
         except Exception as e:
             logger.error(f"Error creating user with telegram_id {user_id}: {e}")
-            await message.answer("An error occurred while registering. Please try again later.")
+            await send_message(get_bot(), message.chat.id, "An error occurred while registering. Please try again later.")
             return
 
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [
-                InlineKeyboardButton(
-                    text="English",
-                    callback_data=LanguageCallback(lang_code='en', ref_arg=ref_arg or '').pack()
-                ),
-                InlineKeyboardButton(
-                    text="Русский",
-                    callback_data=LanguageCallback(lang_code='ru', ref_arg=ref_arg or '').pack()
-                )
-            ]
-        ])
-        await message.answer(
+        keyboard = language_keyboard(ref_arg or '')
+        await send_message(
+            get_bot(),
+            message.chat.id,
             "Please choose your language / Пожалуйста, выберите ваш язык",
             reply_markup=keyboard
         )
@@ -166,9 +190,9 @@ async def language_selected(callback_query: CallbackQuery, callback_data: Langua
     username = callback_query.from_user.username
     firstname = callback_query.from_user.first_name
 
-    user = await Users.get_or_none(telegram_id=user_id)
+    user = await user_cache.get(user_id)
     if not user:
-        await callback_query.message.answer("User not found. Please start the bot again.")
+        await send_message(get_bot(), callback_query.message.chat.id, "User not found. Please start the bot again.")
         return
 
     if user.language:
@@ -177,61 +201,74 @@ async def language_selected(callback_query: CallbackQuery, callback_data: Langua
 
     if ref_arg:
         if ref_arg == user_id:
-            await callback_query.message.answer(get_message("cannot_use_own_referral", lang_code))
+            await send_message(get_bot(), callback_query.message.chat.id, get_message("cannot_use_own_referral", lang_code))
             return
 
         try:
-            dev_codes_list = await Developers.all().values_list("referral_dev_code", flat=True)
-
-            if ref_arg in dev_codes_list:
+            if await is_developer_code(ref_arg):
                 ref_level = 1
                 ref_type = "developer"
-                await bot.send_message(
+                await send_message(
+                    get_bot(),
                     chat_id=user_id,
                     text=get_message("dev_referral", lang_code, ref_arg=ref_arg)
                 )
             else:
-                referrer_user = await Users.get_or_none(telegram_id=ref_arg)
+                referrer_user = await user_cache.get(ref_arg)
                 if referrer_user:
                     ref_level = referrer_user.ref_level + 1
                     ref_type = "user"
                     if referrer_user.username:
-                        await bot.send_message(
+                        await send_message(
+                            get_bot(),
                             chat_id=user_id,
                             text=get_message('user_referral', lang_code, referrer_name=referrer_user.username,
                                              name=username if username else firstname)
                         )
                     else:
-                        await bot.send_message(
+                        await send_message(
+                            get_bot(),
                             chat_id=user_id,
                             text=get_message('user_referral', lang_code, referrer_name=referrer_user.firstname,
                                              name=username if username else firstname)
                         )
                 else:
-                    await callback_query.message.answer(get_message("access_denied_incorrect_referral", lang_code))
+                    await send_message(
+                        get_bot(),
+                        callback_query.message.chat.id,
+                        get_message("access_denied_incorrect_referral", lang_code)
+                    )
                     return
         except Exception as e:
             logger.error(f"Error in checking ref_arg in Developers or Users: {e}")
     else:
-        await callback_query.message.answer(get_message("access_denied_no_referral", lang_code))
+        await send_message(get_bot(), callback_query.message.chat.id, get_message("access_denied_no_referral", lang_code))
         return
 
-    link, unique_id = await generate_unique_link(user_id, ref_arg, lang=lang_code)
-    user.ref_id = ref_arg
-    user.ref_type = ref_type
-    user.ref_level = ref_level
-    user.used_unique_links[unique_id] = False
-    user.language = lang_code
+    link, unique_id, expires_at = await generate_unique_link(user_id, ref_arg, lang=lang_code)
+    # The cached instance is shared with other handlers, so the row is updated
+    # in the database and the cache entry is dropped only once the transaction commits.
     try:
-        await user.save()
-        logger.info(f"Updated user {user_id} with ref_id {ref_arg} and language {lang_code}")
+        async with in_transaction() as conn:
+            await Users.filter(telegram_id=user_id).using_db(conn).update(
+                ref_id=ref_arg, ref_type=ref_type, ref_level=ref_level, language=lang_code)
+            links = await attach_referral(ref_arg, user_id, using_db=conn)
+            await record_links(links, using_db=conn)
+            await create_unique_link(unique_id, user_id, expires_at=expires_at, using_db=conn)
+        user_cache.invalidate(user_id)
+        logger.info("Updated user %s with ref_id %s and language %s", user_id, ref_arg, lang_code)
     except Exception as e:
         logger.error(f"Error updating user {user_id}: {e}")
-        await callback_query.message.answer("An error occurred while updating your profile. Please try again later.")
+        await send_message(
+            get_bot(),
+            callback_query.message.chat.id,
+            "An error occurred while updating your profile. Please try again later."
+        )
         return
 
     ref_link = f"{tg_bot_link}?start={user_id}"
-    await bot.send_message(
+    await send_message(
+        get_bot(),
         chat_id=user_id,
         text=get_message('your_referral_link', lang_code, ref_link=ref_link)
     )
@@ -246,7 +283,8 @@ async def language_selected(callback_query: CallbackQuery, callback_data: Langua
         ]
     )
 
-    await bot.send_message(
+    await send_message(
+        get_bot(),
         chat_id=user_id,
         text=get_message('your_one_time_link_text', lang_code),
         reply_markup=keyboard
@@ -259,58 +297,63 @@ async def language_selected(callback_query: CallbackQuery, callback_data: Langua
 @router.message(Command("add_dev_code"))
 async def add_referral_command(message: Message):
     if str(message.from_user.id) != allowed_user_id:
-        await message.answer("Access denied. No referral link provided.")
+        await send_message(get_bot(), message.chat.id, "Access denied. No referral link provided.")
         return
 
     parts = message.text.split(maxsplit=1)
     if len(parts) < 2:
-        await message.answer("Please enter the referral code after the command. Example: /add_dev_code ABC123")
+        await send_message(
+            get_bot(),
+            message.chat.id,
+            "Please enter the referral code after the command. Example: /add_dev_code ABC123"
+        )
         return
 
     referral_code = parts[1].strip()
 
     if not referral_code:
-        await message.answer("The referral code cannot be blank. Please try again.")
+        await send_message(get_bot(), message.chat.id, "The referral code cannot be blank. Please try again.")
         return
 
     try:
         existing_code = await Developers.get_or_none(referral_dev_code=referral_code)
         if existing_code:
-            await message.answer("This referral code already exists in the database.")
+            await send_message(get_bot(), message.chat.id, "This referral code already exists in the database.")
             return
 
         await Developers.create(referral_dev_code=referral_code)
-        await message.answer(f"Referral code '{referral_code}' successfully added.")
+        add_developer_code(referral_code)
+        await send_message(get_bot(), message.chat.id, f"Referral code '{referral_code}' successfully added.")
         logger.info(f"Added new developer referral code: {referral_code}")
     except Exception as e:
         logger.error(f"Error when adding a referral code: {e}")
-        await message.answer(f"Error when adding a referral code: {e}")
+        await send_message(get_bot(), message.chat.id, f"Error when adding a referral code: {e}")
 
 
 @router.message(Command("show_dev_codes"))
 async def show_developer_codes_command(message: Message):
     if str(message.from_user.id) != allowed_user_id:
-        await message.answer("Access denied. No referral link provided.")
+        await send_message(get_bot(), message.chat.id, "Access denied. No referral link provided.")
         return
     try:
         existing_codes = await Developers.all()
         if existing_codes:
             codes_list = "\n".join(
                 [dev.referral_dev_code for dev in existing_codes])
-            await message.answer(f"Existing developer referral codes:\n{codes_list}")
+            await send_message(get_bot(), message.chat.id, f"Existing developer referral codes:\n{codes_list}")
         else:
-            await message.answer("There are no existing developer referral codes.")
+            await send_message(get_bot(), message.chat.id, "There are no existing developer referral codes.")
     except Exception as e:
         logger.error(f"Error in displaying developer referral codes: {e}")
-        await message.answer(f"Error in displaying developer referral codes: {e}")
+        await send_message(get_bot(), message.chat.id, f"Error in displaying developer referral codes: {e}")
 
 
 @router.message()
 async def forward_user_message(message: Message):
     if str(message.from_user.id) != allowed_user_id:
         try:
-            await message.forward(chat_id=allowed_user_id)
-            logger.info(f"Message from user {message.from_user.id} was forwarded to admin.")
+            await forward_message(message, allowed_user_id)
+            logger.info("Message from user %s was forwarded to admin.", message.from_user.id)
         except Exception as e:
             logger.error(f"Error forwarding message from user {message.from_user.id}: {e}")
 
@@ -321,7 +364,47 @@ dp.include_router(router)
 async def start_telegram_bot():
     try:
         logger.info("Starting the bot...")
-        await dp.start_polling(bot)
+        await dp.start_polling(get_bot(), handle_signals=False)
         logger.info("Bot has stopped.")
     except Exception as e:
         logger.error(f"Error in starting the bot: {e}")
+
+
+async def set_telegram_webhook():
+    try:
+        await get_bot().set_webhook(
+            url=f"{tg_webhook_url}{tg_webhook_path}",
+            secret_token=tg_webhook_secret,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        logger.info(f"Telegram webhook set to {tg_webhook_url}{tg_webhook_path}")
+    except Exception as e:
+        logger.error(f"Error in setting the webhook: {e}")
+        raise
+
+
+async def delete_telegram_webhook():
+    try:
+        await get_bot().delete_webhook()
+        logger.info("Telegram webhook deleted.")
+    except Exception as e:
+        logger.error(f"Error in deleting the webhook: {e}")
+
+
+async def feed_webhook_update(data: dict):
+    bot = get_bot()
+    update = Update.model_validate(data, context={"bot": bot})
+    await dp.feed_update(bot, update)
+
+
+async def run_telegram_webhook():
+    """Register the webhook and keep it until cancelled.
+
+    A failed registration raises, so the leader job supervisor retries it
+    instead of the process waiting for updates that never arrive.
+    """
+    await set_telegram_webhook()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await delete_telegram_webhook()
@@ -1,41 +1,103 @@
 import json
+import hmac
 import logging
 import asyncio
 import os
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Header, Response
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from services.encode_decode_id import decode_id
-from services.save_user_delegation import save_user_delegation_tia, save_user_delegation_fet
+from services.save_user_delegation import save_user_delegation
+from services.chain_registry import load_chain_registry, get_chain, registry_response, watch_chain_registry
+from services.delegation_queue import delegation_queue, DELEGATION_WRITE_BEHIND
+from services.delegation_batch import (ingest_delegation_array, ingest_delegation_stream, read_body, BatchTooLarge,
+                                      DELEGATION_BATCH_API_KEY, DELEGATION_BATCH_MAX_BYTES)
 from services.validate_user_link import validate_user_link
-from bot.telegram_bot import start_telegram_bot, send_new_link_to_user
+from services.chain_builder import build_referral_tree
+from services.referral_ancestry import get_uplines, count_descendants
+from services.referral_stats import get_referrer_stats, get_leaderboard, is_valid_metric, LEADERBOARD_MAX_LIMIT
+from services.unique_links import run_link_pruner
+from services.tx_verifier import run_tx_verifier, TX_VERIFY_ENABLED
+from services.developer_codes import load_developer_codes
+from services.leader_election import LeaderElection
+from services.db_config import tortoise_config
+from services.startup import startup_timer, prepare_schema, check_database, STARTUP_MODE
+from bot.telegram_bot import (start_telegram_bot, run_telegram_webhook, send_new_link_to_user,
+                              feed_webhook_update, bot_created, tg_bot_mode, tg_webhook_path, tg_webhook_secret)
+from bot.message_dispatcher import message_dispatcher
+from bot.locales import watch_locales
+from services.logging_config import setup_logging, RequestLogContextMiddleware
+from services.metrics import (HTTPMetricsMiddleware, instrument_tortoise, monitor_event_loop_lag, register_gauge,
+                              render_metrics, sample_gauges)
 from tortoise.contrib.fastapi import register_tortoise
 from schemas import TxData, LinkData
 
-logging.basicConfig(level=logging.INFO)
+setup_logging()
 logger = logging.getLogger(__name__)
+startup_timer.mark("imports")
 
 allowed_origins = os.getenv("ALLOWED_ORIGINS")
 allowed_origins_list = json.loads(allowed_origins) if allowed_origins else []
 
+# Bearer token for operational endpoints (/metrics, queue stats); they are closed while it is unset.
+internal_api_token = os.getenv("INTERNAL_API_TOKEN")
+
+leader_election = LeaderElection(os.getenv('DATABASE_URL'))
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    logger.info("Starting Telegram bot...")
-    asyncio.create_task(start_telegram_bot())
+    if tg_bot_mode == "webhook" and not tg_webhook_secret:
+        raise RuntimeError("TG_WEBHOOK_SECRET must be set when TG_BOT_MODE=webhook.")
+    with startup_timer.step("migrations"):
+        await prepare_schema()
+    instrument_tortoise()
+    loop_lag_monitor = asyncio.create_task(monitor_event_loop_lag())
+    gauge_sampler = asyncio.create_task(sample_gauges())
+    with startup_timer.step("chain_registry"):
+        load_chain_registry()
+    registry_watcher = asyncio.create_task(watch_chain_registry())
+    with startup_timer.step("developer_codes"):
+        await load_developer_codes()
+    message_dispatcher.start()
+    locales_watcher = asyncio.create_task(watch_locales())
+    if tg_bot_mode == "webhook":
+        leader_election.add_job(run_telegram_webhook)
+    else:
+        leader_election.add_job(start_telegram_bot)
+    leader_election.add_job(run_link_pruner)
+    if TX_VERIFY_ENABLED:
+        leader_election.add_job(run_tx_verifier)
+    logger.info("Starting leader election for the Telegram bot and background jobs...")
+    leader_election.start()
+    if DELEGATION_WRITE_BEHIND:
+        delegation_queue.start()
+    startup_timer.finish()
     yield
     logger.info("Shutting down Telegram bot...")
+    await leader_election.stop()
+    locales_watcher.cancel()
+    registry_watcher.cancel()
+    loop_lag_monitor.cancel()
+    gauge_sampler.cancel()
+    await delegation_queue.drain()
+    await message_dispatcher.stop()
 
 
 app = FastAPI(lifespan=lifespan)
 
 register_tortoise(
     app,
-    db_url=os.getenv('DATABASE_URL'),
-    modules={'models': ['models.models']},
-    generate_schemas=True,
+    config=tortoise_config(),
+    generate_schemas=False,
     add_exception_handlers=True,
 )
 
+register_gauge("telegram_send_queue_depth", "Messages waiting in the outbound Telegram queue",
+               lambda: message_dispatcher.depth)
+register_gauge("delegation_queue_depth", "Delegation reports waiting for a write-behind flush",
+               lambda: delegation_queue.queue.qsize())
+
+app.add_middleware(HTTPMetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=allowed_origins_list,
@@ -43,11 +105,56 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(RequestLogContextMiddleware)
+
+
+def check_internal_token(authorization: str):
+    scheme, _, token = (authorization or "").partition(" ")
+    if not internal_api_token or scheme.lower() != "bearer" or not hmac.compare_digest(
+            token.strip().encode(), internal_api_token.encode()):
+        raise HTTPException(status_code=403, detail="Invalid internal token.")
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics(authorization: str = Header(None)):
+    check_internal_token(authorization)
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    """Liveness: the process is up and serving requests."""
+    return {"status": "ok"}
+
+
+@app.get("/readyz", include_in_schema=False)
+async def readyz():
+    """Readiness: startup has finished and the database answers; reports pool and bot status."""
+    database = await check_database()
+    ready = startup_timer.completed and database["ok"]
+    body = {
+        "status": "ready" if ready else "not ready",
+        "mode": STARTUP_MODE,
+        "startup_complete": startup_timer.completed,
+        "startup_s": startup_timer.as_dict(),
+        "database": database,
+        "bot": {"mode": tg_bot_mode, "leader": leader_election.is_leader, "created": bot_created()},
+    }
+    return Response(content=json.dumps(body), media_type="application/json", status_code=200 if ready else 503)
+
+
+@app.get("/api/validators")
+async def get_validators(accept_encoding: str = Header(None), if_none_match: str = Header(None)):
+    """The validator/chain registry, served from memory with ETag revalidation and precompressed bodies."""
+    status_code, body, headers = registry_response(accept_encoding, if_none_match)
+    return Response(content=body, status_code=status_code, headers=headers,
+                    media_type="application/json" if status_code == 200 else None)
 
 
 @app.post("/api/check_link")
 async def check_link(data: LinkData):
-    logger.info(f"Check link request: {data}")
+    logger.info("Check link request: %s", data)
     try:
         user_id = data.u_id
         ref_id = data.r_id
@@ -64,7 +171,7 @@ async def check_link(data: LinkData):
             logger.error(f"Error decoding IDs: {e}")
             raise HTTPException(status_code=400, detail="Invalid ID format.")
         result = await validate_user_link(decoded_user_id, decoded_ref_id, link_id)
-        logger.info(result)
+        logger.info("Check link result: %s", result)
         if result.get("valid"):
             await send_new_link_to_user(decoded_user_id)
         return result
@@ -76,41 +183,108 @@ async def check_link(data: LinkData):
         raise HTTPException(status_code=500, detail="Internal server error.")
 
 
-@app.post("/api/tia")
-async def handle_broadcast_request_tia(data: TxData):
-    logger.info(f"request:{data}")
+@app.post(tg_webhook_path, include_in_schema=False)
+async def telegram_webhook(request: Request, x_telegram_bot_api_secret_token: str = Header(None)):
+    if tg_bot_mode != "webhook":
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not tg_webhook_secret or not hmac.compare_digest(
+            (x_telegram_bot_api_secret_token or "").encode(), tg_webhook_secret.encode()):
+        raise HTTPException(status_code=403, detail="Invalid secret token.")
     try:
-        telegram_id, address, tx, tx_error = get_data(data)
-        result = await save_user_delegation_tia(
-            telegram_id, address, tx, tx_error)
-        logger.info(f"result {result}")
-        return "ok"
+        await feed_webhook_update(await request.json())
+    except Exception as e:
+        logger.error(f"Error processing Telegram update: {e}")
+    return {"ok": True}
+
+
+@app.post("/api/delegations/batch")
+async def handle_delegation_batch(request: Request, x_api_key: str = Header(None)):
+    """Apply many delegation reports at once from a JSON array or an NDJSON body."""
+    if not DELEGATION_BATCH_API_KEY or not hmac.compare_digest(
+            (x_api_key or "").encode(), DELEGATION_BATCH_API_KEY.encode()):
+        raise HTTPException(status_code=403, detail="Invalid API key.")
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > DELEGATION_BATCH_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"A batch can be at most {DELEGATION_BATCH_MAX_BYTES} bytes.")
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    try:
+        if content_type in ("application/x-ndjson", "application/jsonl"):
+            result = await ingest_delegation_stream(request.stream())
+        else:
+            try:
+                items = json.loads(await read_body(request.stream()))
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON.")
+            if not isinstance(items, list):
+                raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON.")
+            result = await ingest_delegation_array(items)
+        logger.info("Delegation batch: %s accepted, %s rejected", result["accepted"], result["rejected"])
+        return result
+    except BatchTooLarge as e:
+        logger.warning("Delegation batch too large after %s applied reports: %s", len(e.summary["results"]), e)
+        return Response(content=json.dumps({"detail": str(e), **e.summary}), status_code=413,
+                        media_type="application/json")
     except HTTPException as e:
-        logger.error(f"Error processing TIA request: {e.detail}")
+        logger.error(f"Error processing delegation batch: {e.detail}")
         raise e
     except Exception as e:
-        logger.error(f"Unexpected error processing TIA request: {e}")
+        logger.error(f"Unexpected error processing delegation batch: {e}")
         raise HTTPException(
             status_code=500, detail=f"Error processing request: {str(e)}")
 
 
-@app.post("/api/fet")
-async def handle_broadcast_request_fet(data: TxData):
-    logger.info(f"request:{data}")
+@app.post("/api/delegation/{chain}")
+async def handle_broadcast_request(chain: str, data: TxData):
+    logger.info("%s request: %s", chain, data)
+    if not get_chain(chain):
+        raise HTTPException(status_code=404, detail=f"Unknown chain: {chain}")
     try:
         telegram_id, address, tx, tx_error = get_data(data)
-        result = await save_user_delegation_fet(
-            telegram_id, address, tx, tx_error)
-        logger.info(f"result {result}")
+        if delegation_queue.running:
+            await delegation_queue.put(chain, telegram_id, address, tx, tx_error)
+            return "ok"
+        result = await save_user_delegation(
+            chain, telegram_id, address, tx, tx_error)
+        logger.info("result %s", result)
         return "ok"
     except HTTPException as e:
-        logger.error(f"Error processing FET request: {e.detail}")
+        logger.error(f"Error processing {chain} request: {e.detail}")
         raise e
     except Exception as e:
-        logger.error(f"Unexpected error processing FET request: {e}")
+        logger.error(f"Unexpected error processing {chain} request: {e}")
         raise HTTPException(
-            status_code=500, detail=f"Error processing request: {str(e)}"
-        )
+            status_code=500, detail=f"Error processing request: {str(e)}")
+
+
+@app.get("/api/delegation_queue/stats")
+async def get_delegation_queue_stats(authorization: str = Header(None)):
+    check_internal_token(authorization)
+    return delegation_queue.stats()
+
+
+@app.get("/api/referral_tree/{telegram_id}")
+async def get_referral_tree(telegram_id: str, max_depth: int = None):
+    logger.info("Referral tree request: %s, max_depth=%s", telegram_id, max_depth)
+    if max_depth is not None and max_depth < 0:
+        raise HTTPException(status_code=400, detail="max_depth cannot be negative.")
+    try:
+        tree = await build_referral_tree(telegram_id, max_depth=max_depth)
+        return {telegram_id: tree}
+    except Exception as e:
+        logger.error(f"Unexpected error in /api/referral_tree: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error.")
+
+
+@app.get("/api/referral_ancestry/{telegram_id}")
+async def get_referral_ancestry(telegram_id: str):
+    logger.info("Referral ancestry request: %s", telegram_id)
+    try:
+        uplines = await get_uplines(telegram_id)
+        descendants_count = await count_descendants(telegram_id)
+        return {"telegram_id": telegram_id, "uplines": uplines, "descendants_count": descendants_count}
+    except Exception as e:
+        logger.error(f"Unexpected error in /api/referral_ancestry: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error.")
 
 
 def get_data(data):
@@ -130,3 +304,26 @@ def get_data(data):
         raise HTTPException(status_code=400, detail="Invalid ID format.")
 
     return [telegram_id, address, tx, tx_error]
+
+
+@app.get("/api/stats/leaderboard")
+async def get_referral_leaderboard(metric: str = "total", limit: int = 20, offset: int = 0):
+    if not is_valid_metric(metric):
+        raise HTTPException(status_code=400, detail=f"Unknown metric: {metric}")
+    if not 0 < limit <= LEADERBOARD_MAX_LIMIT or offset < 0:
+        raise HTTPException(
+            status_code=400, detail=f"limit must be between 1 and {LEADERBOARD_MAX_LIMIT}, offset cannot be negative.")
+    try:
+        return await get_leaderboard(metric, limit, offset)
+    except Exception as e:
+        logger.error(f"Unexpected error in /api/stats/leaderboard: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error.")
+
+
+@app.get("/api/stats/{referrer_id}")
+async def get_referral_stats(referrer_id: str):
+    try:
+        return await get_referrer_stats(referrer_id)
+    except Exception as e:
+        logger.error(f"Unexpected error in /api/stats: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error.")
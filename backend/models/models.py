@@ -18,17 +18,11 @@ class Users(Model):
     id = fields.IntField(pk=True)
     telegram_id = fields.CharField(max_length=255, unique=True, index=True)
     username = fields.CharField(max_length=255, null=True)
+    username_refreshed_at = fields.DatetimeField(null=True, index=True)
     firstname = fields.CharField(max_length=255, null=True)
     ref_id = fields.CharField(max_length=255)
     ref_type = fields.CharField(max_length=10)
     ref_level = fields.IntField()
-    used_unique_links = fields.JSONField(default=dict)
-    tia_address = fields.CharField(max_length=255, null=True)
-    tia_tx = fields.CharField(max_length=255, null=True)
-    tia_tx_error = fields.CharField(max_length=255, null=True)
-    fet_address = fields.CharField(max_length=255, null=True)
-    fet_tx = fields.CharField(max_length=255, null=True)
-    fet_tx_error = fields.CharField(max_length=255, null=True)
     language = fields.CharField(max_length=5, null=True)
 
     class Meta:
@@ -36,3 +30,97 @@ class Users(Model):
 
     def __str__(self):
         return f"User(telegram_id={self.telegram_id})"
+
+
+class Delegations(Model):
+    id = fields.IntField(pk=True)
+    telegram_id = fields.CharField(max_length=255, index=True)
+    chain = fields.CharField(max_length=32, index=True)
+    address = fields.CharField(max_length=255, null=True)
+    tx = fields.CharField(max_length=255, null=True)
+    tx_error = fields.CharField(max_length=255, null=True)
+    verification_status = fields.CharField(max_length=16, null=True, index=True)
+    verified_amount = fields.CharField(max_length=64, null=True)
+    verification_error = fields.CharField(max_length=255, null=True)
+    verification_checked_at = fields.DatetimeField(null=True)
+    verify_started_at = fields.DatetimeField(null=True)
+    created_at = fields.DatetimeField(auto_now_add=True)
+    updated_at = fields.DatetimeField(auto_now=True)
+
+    class Meta:
+        table = "delegations"
+        unique_together = (("telegram_id", "chain"),)
+
+    def __str__(self):
+        return f"Delegation(telegram_id={self.telegram_id}, chain={self.chain})"
+
+
+class DelegationTxs(Model):
+    id = fields.IntField(pk=True)
+    telegram_id = fields.CharField(max_length=255)
+    chain = fields.CharField(max_length=32)
+    tx = fields.CharField(max_length=255)
+    created_at = fields.DatetimeField(auto_now_add=True)
+
+    class Meta:
+        table = "delegation_txs"
+        unique_together = (("telegram_id", "chain", "tx"),)
+
+    def __str__(self):
+        return f"DelegationTx(telegram_id={self.telegram_id}, chain={self.chain}, tx={self.tx})"
+
+
+class UniqueLinks(Model):
+    link_id = fields.CharField(max_length=64, pk=True)
+    telegram_id = fields.CharField(max_length=255, index=True)
+    used = fields.BooleanField(default=False)
+    created_at = fields.DatetimeField(auto_now_add=True)
+    expires_at = fields.DatetimeField(index=True)
+    used_at = fields.DatetimeField(null=True)
+
+    class Meta:
+        table = "unique_links"
+
+    def __str__(self):
+        return f"UniqueLink(link_id={self.link_id}, telegram_id={self.telegram_id}, used={self.used})"
+
+
+class ReferralAncestry(Model):
+    id = fields.IntField(pk=True)
+    ancestor_id = fields.CharField(max_length=255, index=True)
+    descendant_id = fields.CharField(max_length=255, index=True)
+    depth = fields.IntField()
+
+    class Meta:
+        table = "referral_ancestry"
+        unique_together = (("ancestor_id", "descendant_id"),)
+
+    def __str__(self):
+        return f"ReferralAncestry(ancestor_id={self.ancestor_id}, descendant_id={self.descendant_id}, depth={self.depth})"
+
+
+class ReferralStats(Model):
+    id = fields.IntField(pk=True)
+    referrer_id = fields.CharField(max_length=255, index=True)
+    metric = fields.CharField(max_length=64)
+    value = fields.IntField(default=0)
+
+    class Meta:
+        table = "referral_stats"
+        unique_together = (("referrer_id", "metric"),)
+        indexes = (("metric", "value"),)
+
+    def __str__(self):
+        return f"ReferralStats(referrer_id={self.referrer_id}, metric={self.metric}, value={self.value})"
+
+
+class SchemaMigrations(Model):
+    version = fields.IntField(pk=True, generated=False)
+    name = fields.CharField(max_length=255)
+    applied_at = fields.DatetimeField(auto_now_add=True)
+
+    class Meta:
+        table = "schema_migrations"
+
+    def __str__(self):
+        return f"SchemaMigrations(version={self.version}, name={self.name})"
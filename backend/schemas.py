@@ -12,3 +12,7 @@ class LinkData(BaseModel):
     u_id: str
     r_id: str
     link_id: str
+
+
+class DelegationReport(TxData):
+    chain: str
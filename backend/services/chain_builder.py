@@ -1,51 +1,51 @@
 import asyncio
 import json
+import logging
+from services.logging_config import setup_logging
 from tortoise import Tortoise
-from models.models import Users
-
-
-async def get_user_referrals(telegram_id):
-    try:
-        referrals = await Users.filter(ref_id=telegram_id).all()
-        print(f"Referrals for {telegram_id}: {[user.telegram_id for user in referrals]}")
-        return referrals
-    except Exception as e:
-        print(f"Error in getting referrals {telegram_id}: {e}")
-        return []
-
-
-async def build_referral_tree(telegram_id, depth=0, max_depth=None, visited=None):
-    if visited is None:
-        visited = set()
-    if telegram_id in visited:
-        print(f"Cycle detected in user {telegram_id}, stop recursion.")
-        return {}
-    visited.add(telegram_id)
-
+from services.db_config import read_connection
+
+logger = logging.getLogger(__name__)
+
+REFERRAL_SUBTREE_SQL = """
+WITH RECURSIVE subtree AS (
+    SELECT u.telegram_id, u.ref_id, 1 AS depth,
+           ARRAY[$1::varchar, u.telegram_id::varchar] AS path
+    FROM users u
+    WHERE u.ref_id = $1
+      AND u.telegram_id <> $1
+      AND ($2::int IS NULL OR $2::int > 0)
+    UNION ALL
+    SELECT u.telegram_id, u.ref_id, s.depth + 1,
+           s.path || u.telegram_id::varchar
+    FROM users u
+    JOIN subtree s ON u.ref_id = s.telegram_id
+    WHERE NOT u.telegram_id = ANY(s.path)
+      AND ($2::int IS NULL OR s.depth < $2::int)
+)
+SELECT telegram_id, ref_id, depth FROM subtree ORDER BY depth
+"""
+
+
+async def get_referral_subtree(telegram_id: str, max_depth: int = None):
+    return await read_connection().execute_query_dict(REFERRAL_SUBTREE_SQL, [telegram_id, max_depth])
+
+
+async def build_referral_tree(telegram_id: str, max_depth: int = None) -> dict:
+    """Build the nested referral tree of a user with a single recursive query.
+
+    Rows come back ordered by depth, so every parent node already exists
+    when its referrals are attached. Cycles are cut inside the query.
+    Database errors propagate, so callers can tell them from an empty tree.
+    """
     tree = {}
-    try:
-        referrals = await get_user_referrals(telegram_id)
-    except Exception as e:
-        print(f"Error in building tree for user {telegram_id}: {e}")
-        return tree
-
-    if not referrals:
-        return tree
-
-    for referral in referrals:
-        if max_depth is not None and depth >= max_depth:
-            continue
-        try:
-            subtree = await build_referral_tree(
-                referral.telegram_id,
-                depth=depth + 1,
-                max_depth=max_depth,
-                visited=visited
-            )
-            tree[referral.telegram_id] = subtree
-        except Exception as e:
-            print(f"Error in processing a referral {referral.telegram_id}: {e}")
-            continue
+    rows = await get_referral_subtree(telegram_id, max_depth)
+
+    nodes = {telegram_id: tree}
+    for row in rows:
+        subtree = {}
+        nodes[row["ref_id"]][row["telegram_id"]] = subtree
+        nodes[row["telegram_id"]] = subtree
 
     return tree
 
@@ -70,4 +70,5 @@ async def main():
 
 
 if __name__ == '__main__':
+    setup_logging()
     asyncio.run(main())
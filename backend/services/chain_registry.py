@@ -0,0 +1,122 @@
+import os
+import json
+import gzip
+import asyncio
+import hashlib
+import logging
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+VALIDATORS_CONFIG = os.getenv('VALIDATORS_CONFIG', 'config/validators.json')
+CHAIN_REGISTRY_RELOAD_INTERVAL = float(os.getenv('CHAIN_REGISTRY_RELOAD_INTERVAL', '5'))
+CHAIN_REGISTRY_MAX_AGE = int(os.getenv('CHAIN_REGISTRY_MAX_AGE', '60'))
+
+# Preferred order when a client accepts several encodings.
+ENCODINGS = ("br", "gzip", "identity")
+
+_chains = None
+_mtime = None
+_bodies = {}
+_etag = None
+
+
+def encode_bodies(validators: list) -> dict:
+    """Serialize the registry once and compress it once per encoding, so requests only pick a body."""
+    body = json.dumps(validators, ensure_ascii=False, separators=(",", ":")).encode()
+    bodies = {"identity": body, "gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        bodies["br"] = brotli.compress(body, quality=11)
+    return bodies
+
+
+def load_chain_registry(path: str = VALIDATORS_CONFIG) -> dict:
+    global _chains, _mtime, _bodies, _etag
+    mtime = os.stat(path).st_mtime
+    with open(path, 'r', encoding='utf-8') as f:
+        validators = json.load(f)
+    chains = {validator["chainKey"]: validator for validator in validators}
+    bodies = encode_bodies(validators)
+    _chains, _mtime, _bodies = chains, mtime, bodies
+    _etag = hashlib.sha256(bodies["identity"]).hexdigest()[:32]
+    logger.info(f"Loaded chain registry from {path}: {', '.join(_chains)}")
+    return _chains
+
+
+def get_chains() -> dict:
+    if _chains is None:
+        load_chain_registry()
+    return _chains
+
+
+def get_chain(chain: str):
+    return get_chains().get(chain)
+
+
+def etag_for(encoding: str) -> str:
+    """Strong ETag of one representation; each encoding is a different byte sequence and gets its own tag."""
+    return f'"{_etag}"' if encoding == "identity" else f'"{_etag}-{encoding}"'
+
+
+def choose_encoding(accept_encoding: str) -> str:
+    qualities = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            qualities[name.strip().lower()] = quality
+    for encoding in ENCODINGS:
+        if encoding in _bodies and qualities.get(encoding, qualities.get("*", 0.0)) > 0:
+            return encoding
+    return "identity"
+
+
+def registry_response(accept_encoding: str = None, if_none_match: str = None) -> tuple:
+    """Return (status, body, headers) for the registry endpoint without touching the disk.
+
+    A request whose If-None-Match lists any current ETag gets 304 with no body.
+    """
+    get_chains()
+    encoding = choose_encoding(accept_encoding)
+    headers = {
+        "ETag": etag_for(encoding),
+        "Cache-Control": f"public, max-age={CHAIN_REGISTRY_MAX_AGE}",
+        "Vary": "Accept-Encoding",
+    }
+    if if_none_match:
+        current = {etag_for(name) for name in _bodies}
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if "*" in tags or tags & current:
+            return 304, b"", headers
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return 200, _bodies[encoding], headers
+
+
+async def watch_chain_registry(path: str = VALIDATORS_CONFIG, interval: float = CHAIN_REGISTRY_RELOAD_INTERVAL):
+    """Reload the registry whenever its file changes.
+
+    A file that fails to parse is reported and the previous registry stays in use.
+    """
+    global _mtime
+    while True:
+        await asyncio.sleep(interval)
+        mtime = _mtime
+        try:
+            mtime = os.stat(path).st_mtime
+            if mtime == _mtime:
+                continue
+            load_chain_registry(path)
+        except Exception as e:
+            _mtime = mtime
+            logger.error(f"Error reloading chain registry from {path}: {e}")
@@ -0,0 +1,68 @@
+import os
+import logging
+from tortoise import connections
+from tortoise.backends.base.config_generator import expand_db_url
+from tortoise.exceptions import ConfigurationError
+from tortoise.utils import generate_schema_for_client
+
+logger = logging.getLogger(__name__)
+
+DATABASE_URL = os.getenv('DATABASE_URL')
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '2'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+DB_POOL_MAX_INACTIVE_LIFETIME = float(os.getenv('DB_POOL_MAX_INACTIVE_LIFETIME', '300'))
+DB_REPLICA_URL = os.getenv('DB_REPLICA_URL')
+DB_REPLICA_POOL_MIN_SIZE = int(os.getenv('DB_REPLICA_POOL_MIN_SIZE', '1'))
+DB_REPLICA_POOL_MAX_SIZE = int(os.getenv('DB_REPLICA_POOL_MAX_SIZE', '4'))
+
+READ_CONNECTION = "replica"
+
+POOLED_ENGINES = ("tortoise.backends.asyncpg", "tortoise.backends.psycopg")
+
+
+def connection_config(db_url: str, min_size: int, max_size: int) -> dict:
+    config = expand_db_url(db_url)
+    if config["engine"] in POOLED_ENGINES:
+        config["credentials"].update({"minsize": min_size, "maxsize": max_size})
+        if config["engine"] == "tortoise.backends.asyncpg":
+            config["credentials"]["max_inactive_connection_lifetime"] = DB_POOL_MAX_INACTIVE_LIFETIME
+    return config
+
+
+def tortoise_config(db_url: str = None, replica_url: str = None) -> dict:
+    """Tortoise config with a sized primary pool and a separate read-only pool.
+
+    The read-only connection points at DB_REPLICA_URL when set. Otherwise it is
+    a second, smaller pool on the primary, so read-only work still cannot take
+    every primary connection. SQLite gets no read-only connection unless a
+    replica URL is given, as a second in-memory database would be empty.
+    """
+    db_url = db_url or DATABASE_URL
+    replica_url = replica_url or DB_REPLICA_URL
+    config = {
+        "connections": {"default": connection_config(db_url, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE)},
+        "apps": {"models": {"models": ["models.models"], "default_connection": "default"}},
+    }
+    if not replica_url and config["connections"]["default"]["engine"] in POOLED_ENGINES:
+        replica_url = db_url
+    if replica_url and DB_REPLICA_POOL_MAX_SIZE > 0:
+        config["connections"][READ_CONNECTION] = connection_config(
+            replica_url, DB_REPLICA_POOL_MIN_SIZE, DB_REPLICA_POOL_MAX_SIZE)
+    return config
+
+
+def read_connection():
+    """Connection for read-only queries, falling back to the primary when no replica is configured.
+
+    Replicas may lag, so anything that must see a write it just made keeps
+    using the default connection.
+    """
+    try:
+        return connections.get(READ_CONNECTION)
+    except ConfigurationError:
+        return connections.get("default")
+
+
+async def generate_primary_schemas():
+    """Create missing tables on the primary only; Tortoise.generate_schemas() would also hit the replica."""
+    await generate_schema_for_client(connections.get("default"), safe=True)
@@ -0,0 +1,175 @@
+import os
+import json
+import logging
+from pydantic import TypeAdapter, ValidationError
+from schemas import DelegationReport
+from services.chain_registry import get_chain
+from services.encode_decode_id import decode_id
+from services.save_user_delegation import save_user_delegations_bulk
+
+logger = logging.getLogger(__name__)
+
+DELEGATION_BATCH_CHUNK_SIZE = int(os.getenv('DELEGATION_BATCH_CHUNK_SIZE', '1000'))
+DELEGATION_BATCH_MAX_ITEMS = int(os.getenv('DELEGATION_BATCH_MAX_ITEMS', '50000'))
+DELEGATION_BATCH_MAX_BYTES = int(os.getenv('DELEGATION_BATCH_MAX_BYTES', str(16 * 1024 * 1024)))
+DELEGATION_BATCH_API_KEY = os.getenv('DELEGATION_BATCH_API_KEY')
+
+_reports_adapter = TypeAdapter(list[DelegationReport])
+
+
+class BatchTooLarge(Exception):
+    """Raised when a batch exceeds the item or byte cap.
+
+    Streams are applied as they arrive, so ``summary`` holds the per-item
+    results of the prefix that was already applied; nothing after it was.
+    """
+
+    def __init__(self, message: str, summary: dict = None):
+        super().__init__(message)
+        self.summary = summary or summarize_results([])
+
+
+async def limit_body(chunks, max_bytes: int = DELEGATION_BATCH_MAX_BYTES):
+    """Pass body chunks through, raising BatchTooLarge once more than max_bytes were received."""
+    received = 0
+    async for chunk in chunks:
+        received += len(chunk)
+        if received > max_bytes:
+            raise BatchTooLarge(f"A batch can be at most {max_bytes} bytes.")
+        yield chunk
+
+
+async def read_body(chunks, max_bytes: int = DELEGATION_BATCH_MAX_BYTES) -> bytes:
+    return b"".join([chunk async for chunk in limit_body(chunks, max_bytes)])
+
+
+def validate_reports(items: list) -> list:
+    """Validate raw report dicts, returning a DelegationReport or an error string per item.
+
+    The whole list is validated in one pydantic call; items are only
+    revalidated one by one when that call reports errors.
+    """
+    try:
+        return _reports_adapter.validate_python(items)
+    except ValidationError:
+        pass
+    reports = []
+    for item in items:
+        try:
+            reports.append(DelegationReport.model_validate(item))
+        except ValidationError as e:
+            reports.append("; ".join(f"{'.'.join(map(str, error['loc'])) or 'item'}: {error['msg']}"
+                                     for error in e.errors()))
+    return reports
+
+
+def prepare_record(report) -> tuple:
+    """Turn a validated report into an upsert record, or return an error string."""
+    if isinstance(report, str):
+        return report
+    if not get_chain(report.chain):
+        return f"Unknown chain: {report.chain}"
+    telegram_id = decode_id(report.u_id) if report.u_id else None
+    if not telegram_id:
+        return "Invalid ID format."
+    return (report.chain, telegram_id, report.address, report.tx, report.tx_error)
+
+
+async def apply_chunk(start: int, items: list) -> list:
+    """Validate, decode and upsert one chunk of raw items with a single bulk statement."""
+    prepared = [prepare_record(report) for report in validate_reports(items)]
+    records = [record for record in prepared if isinstance(record, tuple)]
+    rows = iter(())
+    failure = None
+    if records:
+        try:
+            rows = iter(await save_user_delegations_bulk(records))
+        except Exception as e:
+            logger.error(f"Error saving a batch of {len(records)} delegations: {e}")
+            failure = "Error saving delegation."
+
+    results = []
+    for index, record in enumerate(prepared, start):
+        if isinstance(record, str):
+            results.append({"index": index, "status": "invalid", "detail": record})
+        elif failure:
+            results.append({"index": index, "status": "error", "detail": failure})
+        else:
+            row = next(rows)
+            if row is None:
+                results.append({"index": index, "status": "rejected", "detail": f"User {record[1]} not found."})
+            elif row.get("duplicate"):
+                results.append({"index": index, "status": "ok", "duplicate": True})
+            else:
+                results.append({"index": index, "status": "ok"})
+    return results
+
+
+def summarize_results(results: list) -> dict:
+    accepted = sum(1 for result in results if result["status"] == "ok")
+    return {"accepted": accepted, "rejected": len(results) - accepted, "results": results}
+
+
+async def ingest_delegation_array(items: list, chunk_size: int = DELEGATION_BATCH_CHUNK_SIZE) -> dict:
+    if len(items) > DELEGATION_BATCH_MAX_ITEMS:
+        raise BatchTooLarge(f"A batch can hold at most {DELEGATION_BATCH_MAX_ITEMS} reports.")
+    results = []
+    for start in range(0, len(items), chunk_size):
+        results += await apply_chunk(start, items[start:start + chunk_size])
+    return summarize_results(results)
+
+
+async def iter_ndjson_lines(chunks):
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if buffer.strip():
+        yield buffer
+
+
+async def ingest_delegation_stream(chunks, chunk_size: int = DELEGATION_BATCH_CHUNK_SIZE) -> dict:
+    """Apply an NDJSON body chunk by chunk as it arrives, one report per line.
+
+    When the item or byte cap is hit, the lines not yet applied are dropped
+    and BatchTooLarge carries the results of the applied prefix.
+    """
+    results = []
+    pending = []
+    malformed = {}
+    index = 0
+
+    async def flush():
+        nonlocal pending, malformed
+        start = index - len(pending)
+        chunk_results = await apply_chunk(
+            start, [item for offset, item in enumerate(pending) if start + offset not in malformed])
+        # Lines that were not valid JSON are reported in place without reaching validation.
+        applied = iter(chunk_results)
+        for offset in range(len(pending)):
+            if start + offset in malformed:
+                results.append({"index": start + offset, "status": "invalid", "detail": malformed[start + offset]})
+            else:
+                results.append({**next(applied), "index": start + offset})
+        pending, malformed = [], {}
+
+    try:
+        async for line in iter_ndjson_lines(limit_body(chunks)):
+            if index >= DELEGATION_BATCH_MAX_ITEMS:
+                raise BatchTooLarge(f"A batch can hold at most {DELEGATION_BATCH_MAX_ITEMS} reports.")
+            try:
+                pending.append(json.loads(line))
+            except ValueError as e:
+                pending.append(None)
+                malformed[index] = f"Invalid JSON: {e}"
+            index += 1
+            if len(pending) >= chunk_size:
+                await flush()
+    except BatchTooLarge as e:
+        raise BatchTooLarge(str(e), summarize_results(results)) from None
+    if pending:
+        await flush()
+    return summarize_results(results)
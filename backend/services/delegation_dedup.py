@@ -0,0 +1,61 @@
+import os
+import time
+import logging
+from collections import OrderedDict
+from services.metrics import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+DELEGATION_DEDUP_SIZE = int(os.getenv('DELEGATION_DEDUP_SIZE', '100000'))
+DELEGATION_DEDUP_TTL = float(os.getenv('DELEGATION_DEDUP_TTL', '3600'))
+
+
+class DelegationDedupCache:
+    """Remembers the stored result of recently reported (telegram_id, chain, tx) triples.
+
+    Repeated reports of a tx that was already saved are answered from here
+    without a database round trip. Each process has its own cache; the
+    delegation_txs unique index catches what it misses.
+    """
+
+    def __init__(self, maxsize=DELEGATION_DEDUP_SIZE, ttl=DELEGATION_DEDUP_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, telegram_id: str, chain: str, tx: str):
+        if not tx:
+            return None
+        key = (str(telegram_id), chain, tx)
+        entry = self._entries.get(key)
+        if entry is not None:
+            row, expires_at = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                CACHE_REQUESTS.labels("delegation_dedup", "hit").inc()
+                return row
+            del self._entries[key]
+        self.misses += 1
+        CACHE_REQUESTS.labels("delegation_dedup", "miss").inc()
+        return None
+
+    def put(self, telegram_id: str, chain: str, tx: str, row: dict):
+        if not tx:
+            return
+        key = (str(telegram_id), chain, tx)
+        self._entries[key] = (row, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+delegation_dedup = DelegationDedupCache()
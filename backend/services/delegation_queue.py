@@ -0,0 +1,169 @@
+import os
+import time
+import asyncio
+import logging
+from services.save_user_delegation import save_user_delegation, save_user_delegations_bulk
+from services.delegation_dedup import delegation_dedup
+
+logger = logging.getLogger(__name__)
+
+DELEGATION_WRITE_BEHIND = os.getenv('DELEGATION_WRITE_BEHIND', 'false').lower() == 'true'
+DELEGATION_BATCH_SIZE = int(os.getenv('DELEGATION_BATCH_SIZE', '500'))
+DELEGATION_FLUSH_INTERVAL = float(os.getenv('DELEGATION_FLUSH_INTERVAL', '1.0'))
+DELEGATION_QUEUE_SIZE = int(os.getenv('DELEGATION_QUEUE_SIZE', '10000'))
+DELEGATION_DRAIN_TIMEOUT = float(os.getenv('DELEGATION_DRAIN_TIMEOUT', '30'))
+DELEGATION_FLUSH_RETRIES = int(os.getenv('DELEGATION_FLUSH_RETRIES', '5'))
+DELEGATION_RETRY_BACKOFF = float(os.getenv('DELEGATION_RETRY_BACKOFF', '0.5'))
+DELEGATION_RETRY_MAX_BACKOFF = float(os.getenv('DELEGATION_RETRY_MAX_BACKOFF', '8'))
+
+
+class DelegationWriteQueue:
+    """Buffers delegation reports and writes them in bulk from a background worker.
+
+    A batch is flushed once it reaches DELEGATION_BATCH_SIZE records or
+    DELEGATION_FLUSH_INTERVAL seconds after its first record arrived. A failed
+    flush is retried with exponential backoff; if it keeps failing, the records
+    are written one at a time so only the ones that cannot be saved are dropped.
+    """
+
+    def __init__(self, batch_size=DELEGATION_BATCH_SIZE, flush_interval=DELEGATION_FLUSH_INTERVAL,
+                 maxsize=DELEGATION_QUEUE_SIZE, retries=DELEGATION_FLUSH_RETRIES,
+                 retry_backoff=DELEGATION_RETRY_BACKOFF, max_retry_backoff=DELEGATION_RETRY_MAX_BACKOFF):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.worker = None
+        self.enqueued = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.retried = 0
+        self.flushes = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self.worker is not None and not self.worker.done()
+
+    def start(self):
+        if not self.running:
+            self.worker = asyncio.create_task(self._run())
+            logger.info("Delegation write-behind worker started.")
+
+    async def put(self, chain: str, telegram_id: str, address: str, tx: str, tx_error):
+        record = (chain, telegram_id, address, tx, tx_error)
+        if delegation_dedup.get(telegram_id, chain, tx):
+            return
+        if not self.running:
+            return await save_user_delegation(*record)
+        try:
+            self.queue.put_nowait(record)
+            self.enqueued += 1
+        except asyncio.QueueFull:
+            logger.warning("Delegation queue is full, writing the record synchronously.")
+            return await save_user_delegation(*record)
+
+    async def drain(self, timeout: float = DELEGATION_DRAIN_TIMEOUT):
+        if not self.running:
+            return
+        logger.info(f"Draining delegation queue, {self.queue.qsize()} records pending.")
+        try:
+            await asyncio.wait_for(self._stop(), timeout)
+        except asyncio.TimeoutError:
+            self.worker.cancel()
+            logger.error(f"Delegation queue drain timed out, {self.queue.qsize()} records were not written.")
+        self.worker = None
+
+    async def _stop(self):
+        """Queue the stop sentinel behind the pending records and wait for the worker to reach it.
+
+        A full queue only has room once the worker takes the next batch, so
+        the sentinel then waits for it; drain() bounds both waits.
+        """
+        try:
+            self.queue.put_nowait(None)
+        except asyncio.QueueFull:
+            await self.queue.put(None)
+        await self.worker
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "queue_depth": self.queue.qsize(),
+            "enqueued": self.enqueued,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "retried": self.retried,
+            "flushes": self.flushes,
+            "last_flush_latency": self.last_flush_latency,
+            "max_flush_latency": self.max_flush_latency,
+            "avg_flush_latency": self.total_flush_latency / self.flushes if self.flushes else 0.0,
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            record = await self.queue.get()
+            if record is None:
+                return
+            batch = [record]
+            deadline = loop.time() + self.flush_interval
+            stop = False
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    record = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if record is None:
+                    stop = True
+                    break
+                batch.append(record)
+            await self._flush(batch)
+            if stop:
+                return
+
+    async def _flush(self, batch):
+        started = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            try:
+                rows = await save_user_delegations_bulk(batch)
+            except Exception as e:
+                if attempt == self.retries:
+                    logger.error(f"Error flushing {len(batch)} delegation records after {attempt + 1} attempts: {e}; "
+                                 f"writing them one at a time.")
+                    await self._write_each(batch)
+                    break
+                delay = min(self.retry_backoff * 2 ** attempt, self.max_retry_backoff)
+                self.retried += 1
+                logger.warning(f"Error flushing {len(batch)} delegation records: {e}; retrying in {delay:.1f}s.")
+                await asyncio.sleep(delay)
+                continue
+            self.flushed += len(batch)
+            skipped = rows.count(None)
+            if skipped:
+                logger.warning(f"Delegation flush skipped {skipped} records of unknown users.")
+            break
+        latency = time.perf_counter() - started
+        self.flushes += 1
+        self.last_flush_latency = latency
+        self.max_flush_latency = max(self.max_flush_latency, latency)
+        self.total_flush_latency += latency
+
+    async def _write_each(self, batch):
+        for record in batch:
+            try:
+                await save_user_delegation(*record)
+                self.flushed += 1
+            except Exception as e:
+                self.dropped += 1
+                logger.error(f"Error writing delegation record {record}: {e}")
+
+
+delegation_queue = DelegationWriteQueue()
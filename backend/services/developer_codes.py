@@ -0,0 +1,40 @@
+import os
+import time
+import logging
+from models.models import Developers
+
+logger = logging.getLogger(__name__)
+
+DEV_CODES_TTL = int(os.getenv('DEV_CODES_TTL', '60'))
+
+_dev_codes = set()
+_loaded_at = None
+
+
+async def load_developer_codes():
+    global _dev_codes, _loaded_at
+    codes = await Developers.all().values_list("referral_dev_code", flat=True)
+    _dev_codes = set(codes)
+    _loaded_at = time.monotonic()
+    logger.info(f"Loaded {len(_dev_codes)} developer referral codes.")
+    return _dev_codes
+
+
+async def is_developer_code(code: str) -> bool:
+    """Check a referral code against the process-local developer code set.
+
+    The set is reloaded from the database once it is older than DEV_CODES_TTL
+    seconds, so codes added by another process show up without a restart.
+    """
+    if _loaded_at is None or time.monotonic() - _loaded_at > DEV_CODES_TTL:
+        try:
+            await load_developer_codes()
+        except Exception as e:
+            logger.error(f"Error in loading developer referral codes: {e}")
+            if _loaded_at is None:
+                raise
+    return code in _dev_codes
+
+
+def add_developer_code(code: str):
+    _dev_codes.add(code)
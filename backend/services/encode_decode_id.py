@@ -1,7 +1,6 @@
 import base64
 import logging
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
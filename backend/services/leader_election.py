@@ -0,0 +1,110 @@
+import os
+import asyncio
+import logging
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+LEADER_LOCK_ID = int(os.getenv('LEADER_LOCK_ID', '724001'))
+LEADER_CHECK_INTERVAL = float(os.getenv('LEADER_CHECK_INTERVAL', '5'))
+LEADER_JOB_RESTART_DELAY = float(os.getenv('LEADER_JOB_RESTART_DELAY', '5'))
+
+# Tortoise names its Postgres backends in the URL scheme; asyncpg itself only
+# accepts postgres:// and postgresql://.
+POSTGRES_SCHEMES = ("postgres://", "postgresql://", "asyncpg://", "psycopg://")
+
+
+class LeaderElection:
+    """Runs singleton jobs in exactly one process, elected with a Postgres advisory lock.
+
+    The lock is held on a dedicated connection, so it is released as soon as
+    the leader process dies and another process takes over on its next check.
+    Databases other than Postgres have a single process, which always leads.
+    Jobs that return or fail while this process leads are restarted after
+    LEADER_JOB_RESTART_DELAY seconds.
+    """
+
+    def __init__(self, db_url: str, lock_id: int = LEADER_LOCK_ID, interval: float = LEADER_CHECK_INTERVAL):
+        self.db_url = db_url.split('?', 1)[0] if db_url else db_url
+        if self.uses_lock:
+            self.db_url = "postgresql://" + self.db_url.split("://", 1)[1]
+        self.lock_id = lock_id
+        self.interval = interval
+        self.jobs = []
+        self.is_leader = False
+        self._connection = None
+        self._job_tasks = []
+        self._task = None
+
+    @property
+    def uses_lock(self) -> bool:
+        return bool(self.db_url) and self.db_url.startswith(POSTGRES_SCHEMES)
+
+    def add_job(self, job):
+        """Register a zero-argument coroutine factory to run while this process leads."""
+        self.jobs.append(job)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self._resign()
+
+    async def _run(self):
+        while True:
+            try:
+                if not self.is_leader:
+                    if await self._try_acquire():
+                        self._lead()
+                elif self._connection:
+                    await self._connection.fetchval("SELECT 1")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Leader election error, resigning: {e}")
+                await self._resign()
+            await asyncio.sleep(self.interval)
+
+    async def _try_acquire(self) -> bool:
+        if not self.uses_lock:
+            return True
+        if self._connection is None or self._connection.is_closed():
+            self._connection = await asyncpg.connect(self.db_url)
+        return await self._connection.fetchval("SELECT pg_try_advisory_lock($1)", self.lock_id)
+
+    def _lead(self):
+        self.is_leader = True
+        logger.info(f"Process {os.getpid()} became the leader, starting {len(self.jobs)} jobs.")
+        self._job_tasks = [asyncio.create_task(self._supervise(job)) for job in self.jobs]
+
+    async def _supervise(self, job):
+        name = getattr(job, "__name__", repr(job))
+        while True:
+            try:
+                await job()
+                logger.warning(f"Leader job {name} exited, restarting in {LEADER_JOB_RESTART_DELAY}s.")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Leader job {name} failed, restarting in {LEADER_JOB_RESTART_DELAY}s: {e}")
+            await asyncio.sleep(LEADER_JOB_RESTART_DELAY)
+
+    async def _resign(self):
+        if self._job_tasks:
+            for task in self._job_tasks:
+                task.cancel()
+            await asyncio.gather(*self._job_tasks, return_exceptions=True)
+            self._job_tasks = []
+        if self.is_leader:
+            logger.info(f"Process {os.getpid()} is no longer the leader.")
+        self.is_leader = False
+        if self._connection is not None:
+            try:
+                await self._connection.close()
+            except Exception as e:
+                logger.error(f"Error closing leader election connection: {e}")
+            self._connection = None
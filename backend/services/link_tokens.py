@@ -0,0 +1,67 @@
+import os
+import re
+import hmac
+import time
+import base64
+import hashlib
+import secrets
+import logging
+
+logger = logging.getLogger(__name__)
+
+LINK_SIGNING_KEY = os.getenv('LINK_SIGNING_KEY')
+LINK_ACCEPT_UNSIGNED = os.getenv('LINK_ACCEPT_UNSIGNED', 'true').lower() == 'true'
+
+# Without a signing key or bot token there is no secret to sign with, and
+# tokens are neither issued nor accepted.
+_key = None
+if LINK_SIGNING_KEY:
+    _key = LINK_SIGNING_KEY.encode()
+elif os.getenv('TG_BOT_TOKEN'):
+    _key = hashlib.sha256(b"raptor-link-tokens:" + os.getenv('TG_BOT_TOKEN').encode()).digest()
+
+_SIGNATURE_BYTES = 16
+_TOKEN_RE = re.compile(r"^([A-Za-z0-9_-]{16})\.([0-9a-f]{1,12})\.([A-Za-z0-9_-]{22})$")
+_LEGACY_RE = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+VALID, INVALID, EXPIRED, LEGACY = "valid", "invalid", "expired", "legacy"
+
+
+def _sign(nonce: str, expires: str, user_id: str, ref_id: str) -> str:
+    if _key is None:
+        raise RuntimeError("Link tokens need LINK_SIGNING_KEY or TG_BOT_TOKEN to be set.")
+    message = "\x1f".join((nonce, expires, str(user_id), str(ref_id))).encode()
+    digest = hmac.new(_key, message, hashlib.sha256).digest()[:_SIGNATURE_BYTES]
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def issue_link_token(user_id: str, ref_id: str, expires_at: int) -> tuple:
+    """Return a `nonce.expiry.signature` token bound to the user and referrer, and its nonce.
+
+    Only the nonce is stored in unique_links, for the single-use check.
+    """
+    nonce = secrets.token_urlsafe(12)
+    expires = format(int(expires_at), "x")
+    return f"{nonce}.{expires}.{_sign(nonce, expires, user_id, ref_id)}", nonce
+
+
+def verify_link_token(token: str, user_id: str, ref_id: str) -> tuple:
+    """Check a link token without touching the database.
+
+    Returns a (status, nonce) pair. The signature is always computed and
+    compared in constant time, so malformed and forged tokens take as long
+    to reject as real ones.
+    """
+    match = _TOKEN_RE.match(token or "")
+    if not match:
+        if LINK_ACCEPT_UNSIGNED and _LEGACY_RE.match(token or ""):
+            return LEGACY, token
+        nonce, expires, signature = "", "", ""
+    else:
+        nonce, expires, signature = match.groups()
+    expected = _sign(nonce, expires, user_id, ref_id)
+    if not hmac.compare_digest(expected.encode(), signature.encode()) or not match:
+        return INVALID, None
+    if int(expires, 16) <= time.time():
+        return EXPIRED, nonce
+    return VALID, nonce
@@ -0,0 +1,167 @@
+import os
+import sys
+import copy
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from uuid import UUID, uuid4
+from datetime import date, datetime
+from contextvars import ContextVar
+from services.metrics import LOG_RECORDS_DROPPED
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json').lower()
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+LOG_SAMPLE_RATES = json.loads(os.getenv('LOG_SAMPLE_RATES') or '{}')
+LOG_SAMPLE_DEFAULT = float(os.getenv('LOG_SAMPLE_DEFAULT', '1.0'))
+
+_log_context: ContextVar = ContextVar("log_context", default=None)
+_listener = None
+
+# Attributes every LogRecord has; anything else on a record came from `extra=` and is emitted as a field.
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+# Arguments of these types render the same later as now, so their records can be formatted on the listener thread.
+_IMMUTABLE_ARGS = (str, int, float, complex, bytes, type(None), date, datetime, UUID)
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class ContextFilter(logging.Filter):
+    """Tags records with the current request and drops below-WARNING records of unsampled requests."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _log_context.get()
+        if context is None:
+            return True
+        if record.levelno < logging.WARNING and not context["sampled"]:
+            return False
+        record.route = context["route"]
+        record.request_id = context["request_id"]
+        return True
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread where it is safe, and never blocks the caller.
+
+    The stock prepare() renders every message on the calling thread. Here a
+    record whose arguments are all immutable is queued as is, so
+    `logger.info("... %s", request_id)` costs the event loop only a queue put.
+    Records with mutable arguments or exception info are rendered now, since
+    the arguments may change or the traceback go away before the listener
+    gets to them. Records are dropped and counted when the queue is full.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._exception_formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        args = record.args
+        if record.exc_info is None and (not args or (
+                isinstance(args, tuple) and all(isinstance(arg, _IMMUTABLE_ARGS) for arg in args))):
+            return record
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            LOG_RECORDS_DROPPED.inc()
+
+
+def sample_rate(path: str) -> float:
+    """Success-log sample rate of the longest LOG_SAMPLE_RATES path prefix matching `path`."""
+    matches = [prefix for prefix in LOG_SAMPLE_RATES if path.startswith(prefix)]
+    return float(LOG_SAMPLE_RATES[max(matches, key=len)]) if matches else LOG_SAMPLE_DEFAULT
+
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT):
+    """Route all logging through one bounded queue drained by a background thread.
+
+    Safe to call more than once; only the first call configures the root logger.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    if fmt == "json":
+        stream_handler.setFormatter(JSONFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    queue_handler = LazyQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    # uvicorn installs its own synchronous stream handlers; send its records through the queue too.
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers.clear()
+        uvicorn_logger.propagate = True
+
+    _listener = logging.handlers.QueueListener(queue_handler.queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class RequestLogContextMiddleware:
+    """ASGI middleware deciding once per request whether its success logs are kept."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        path = scope["path"]
+        token = _log_context.set({
+            "route": path,
+            "request_id": uuid4().hex[:16],
+            "sampled": random.random() < sample_rate(path),
+        })
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _log_context.reset(token)
@@ -0,0 +1,198 @@
+import os
+import time
+import asyncio
+import logging
+from contextvars import ContextVar
+from contextlib import contextmanager
+from functools import wraps
+from aiogram import BaseMiddleware
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+from tortoise.backends.base.client import BaseDBAsyncClient
+
+logger = logging.getLogger(__name__)
+
+EVENT_LOOP_LAG_INTERVAL = float(os.getenv('EVENT_LOOP_LAG_INTERVAL', '0.5'))
+GAUGE_SAMPLE_INTERVAL = float(os.getenv('GAUGE_SAMPLE_INTERVAL', '5'))
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ["method", "route", "status"])
+DB_QUERIES_PER_REQUEST = Histogram(
+    "db_queries_per_request", "Database queries issued while serving one HTTP request", ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100))
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "Database query latency by client method", ["operation"])
+DB_QUERY_ERRORS = Counter(
+    "db_query_errors_total", "Database queries that raised", ["operation"])
+BOT_HANDLER_DURATION = Histogram(
+    "bot_handler_duration_seconds", "aiogram handler latency", ["event", "handler"])
+BOT_HANDLER_ERRORS = Counter(
+    "bot_handler_errors_total", "aiogram handlers that raised", ["event", "handler"])
+TELEGRAM_SEND_DURATION = Histogram(
+    "telegram_send_duration_seconds", "Latency of outgoing Telegram API requests")
+TELEGRAM_SEND_ERRORS = Counter(
+    "telegram_send_errors_total", "Outgoing Telegram API requests that failed", ["error"])
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds", "Delay between a scheduled wake-up and the actual one",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+CACHE_REQUESTS = Counter(
+    "cache_requests_total", "In-process cache lookups by cache and result (hit or miss)", ["cache", "result"])
+LOG_RECORDS_DROPPED = Counter(
+    "log_records_dropped_total", "Log records dropped because the log queue was full")
+
+_sampled_gauges = []
+
+_request_queries: ContextVar = ContextVar("request_queries", default=None)
+_in_query: ContextVar = ContextVar("in_query", default=False)
+
+DB_CLIENT_METHODS = ("execute_query", "execute_query_dict", "execute_insert", "execute_many", "execute_script")
+
+
+def _instrument_db_method(name, method):
+    @wraps(method)
+    async def wrapper(*args, **kwargs):
+        if _in_query.get():
+            return await method(*args, **kwargs)
+        token = _in_query.set(True)
+        started = time.perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        except Exception:
+            DB_QUERY_ERRORS.labels(name).inc()
+            raise
+        finally:
+            _in_query.reset(token)
+            DB_QUERY_DURATION.labels(name).observe(time.perf_counter() - started)
+            counter = _request_queries.get()
+            if counter is not None:
+                counter[0] += 1
+
+    wrapper.__metrics_wrapped__ = True
+    return wrapper
+
+
+def _instrument_client_class(cls):
+    for name in DB_CLIENT_METHODS:
+        method = cls.__dict__.get(name)
+        if method is not None and not getattr(method, "__metrics_wrapped__", False):
+            setattr(cls, name, _instrument_db_method(name, method))
+
+
+def _instrument_new_client_class(cls, **kwargs):
+    super(BaseDBAsyncClient, cls).__init_subclass__(**kwargs)
+    _instrument_client_class(cls)
+
+
+def instrument_tortoise():
+    """Time every query method of every Tortoise client class, transactions included.
+
+    Classes loaded so far are patched now; BaseDBAsyncClient gets an
+    __init_subclass__ hook, so backends imported later are patched as they load.
+    """
+    BaseDBAsyncClient.__init_subclass__ = classmethod(_instrument_new_client_class)
+    pending = [BaseDBAsyncClient]
+    while pending:
+        cls = pending.pop()
+        pending.extend(cls.__subclasses__())
+        _instrument_client_class(cls)
+
+
+@contextmanager
+def track_queries():
+    """Count the database queries issued by the current task while the block runs."""
+    counter = [0]
+    token = _request_queries.set(counter)
+    try:
+        yield counter
+    finally:
+        _request_queries.reset(token)
+
+
+class HTTPMetricsMiddleware:
+    """ASGI middleware recording latency and database query count per route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        with track_queries() as counter:
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                route = scope.get("route")
+                route_path = getattr(route, "path", "unmatched")
+                HTTP_REQUEST_DURATION.labels(scope["method"], route_path, status["code"]).observe(
+                    time.perf_counter() - started)
+                DB_QUERIES_PER_REQUEST.labels(route_path).observe(counter[0])
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """aiogram inner middleware timing each matched handler."""
+
+    def __init__(self, event: str):
+        self.event = event
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            BOT_HANDLER_ERRORS.labels(self.event, name).inc()
+            raise
+        finally:
+            BOT_HANDLER_DURATION.labels(self.event, name).observe(time.perf_counter() - started)
+
+
+def register_gauge(name: str, documentation: str, function):
+    """Expose function() as a gauge.
+
+    Callback gauges are not written to the multiprocess files, so under
+    PROMETHEUS_MULTIPROC_DIR the value is sampled by sample_gauges() instead.
+    """
+    gauge = Gauge(name, documentation, multiprocess_mode="livesum")
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        gauge.set(function())
+        _sampled_gauges.append((gauge, function))
+    else:
+        gauge.set_function(function)
+
+
+async def sample_gauges(interval: float = GAUGE_SAMPLE_INTERVAL):
+    while _sampled_gauges:
+        for gauge, function in _sampled_gauges:
+            try:
+                gauge.set(function())
+            except Exception as e:
+                logger.error(f"Error sampling gauge {gauge._name}: {e}")
+        await asyncio.sleep(interval)
+
+
+async def monitor_event_loop_lag(interval: float = EVENT_LOOP_LAG_INTERVAL):
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - started - interval))
+
+
+def render_metrics():
+    """Return the exposition body and content type, merging worker processes in multiprocess mode."""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
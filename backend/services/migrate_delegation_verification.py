@@ -0,0 +1,60 @@
+import os
+import logging
+from services.logging_config import setup_logging
+from tortoise import Tortoise, connections, run_async
+
+logger = logging.getLogger(__name__)
+
+ADD_COLUMNS_SQL = """
+ALTER TABLE delegations
+    ADD COLUMN IF NOT EXISTS verification_status VARCHAR(16) NULL,
+    ADD COLUMN IF NOT EXISTS verified_amount VARCHAR(64) NULL,
+    ADD COLUMN IF NOT EXISTS verification_error VARCHAR(255) NULL,
+    ADD COLUMN IF NOT EXISTS verification_checked_at TIMESTAMPTZ NULL
+"""
+
+ADD_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS idx_delegation_verification_status ON delegations (verification_status)
+"""
+
+QUEUE_EXISTING_SQL = """
+UPDATE delegations SET verification_status = 'pending'
+WHERE tx IS NOT NULL AND verification_status IS NULL
+"""
+
+ADD_VERIFY_STARTED_SQL = """
+ALTER TABLE delegations ADD COLUMN IF NOT EXISTS verify_started_at TIMESTAMPTZ NULL
+"""
+
+BACKFILL_VERIFY_STARTED_SQL = """
+UPDATE delegations SET verify_started_at = COALESCE(verification_checked_at, updated_at)
+WHERE tx IS NOT NULL AND verify_started_at IS NULL
+"""
+
+
+async def migrate_delegation_verification():
+    """Add the delegations verification columns and queue every stored tx for verification."""
+    connection = connections.get("default")
+    await connection.execute_script(ADD_COLUMNS_SQL + ";" + ADD_INDEX_SQL + ";" + QUEUE_EXISTING_SQL)
+    logger.info("delegations verification columns are in place.")
+
+
+async def migrate_verify_started_at():
+    """Add delegations.verify_started_at, the start of the tx verifier's give-up window."""
+    connection = connections.get("default")
+    await connection.execute_script(ADD_VERIFY_STARTED_SQL + ";" + BACKFILL_VERIFY_STARTED_SQL)
+    logger.info("delegations.verify_started_at is in place.")
+
+
+async def main():
+    await Tortoise.init(
+        db_url=os.getenv('DATABASE_URL'),
+        modules={'models': ['models.models']}
+    )
+    await migrate_delegation_verification()
+    await migrate_verify_started_at()
+
+
+if __name__ == '__main__':
+    setup_logging()
+    run_async(main())
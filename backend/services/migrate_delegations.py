@@ -0,0 +1,60 @@
+import os
+import logging
+from services.logging_config import setup_logging
+from tortoise import Tortoise, run_async
+from tortoise.transactions import in_transaction
+from models.models import Delegations
+
+logger = logging.getLogger(__name__)
+
+LEGACY_CHAINS = ("tia", "fet")
+
+COLUMN_EXISTS_SQL = """
+SELECT 1 FROM information_schema.columns
+WHERE table_name = 'users' AND column_name = $1
+"""
+
+COPY_DELEGATIONS_SQL = """
+INSERT INTO delegations (telegram_id, chain, address, tx, tx_error, created_at, updated_at)
+SELECT telegram_id, '{chain}', {chain}_address, {chain}_tx, {chain}_tx_error, now(), now()
+FROM users
+WHERE {chain}_address IS NOT NULL OR {chain}_tx IS NOT NULL OR {chain}_tx_error IS NOT NULL
+ON CONFLICT (telegram_id, chain) DO NOTHING
+"""
+
+DROP_COLUMNS_SQL = """
+ALTER TABLE users
+    DROP COLUMN {chain}_address,
+    DROP COLUMN {chain}_tx,
+    DROP COLUMN {chain}_tx_error
+"""
+
+
+async def migrate_delegations():
+    """Move the per-chain users.<chain>_* columns into the delegations table."""
+    async with in_transaction() as conn:
+        for chain in LEGACY_CHAINS:
+            _, rows = await conn.execute_query(COLUMN_EXISTS_SQL, [f"{chain}_address"])
+            if not rows:
+                logger.info(f"users.{chain}_* columns do not exist, nothing to migrate.")
+                continue
+            await conn.execute_query(COPY_DELEGATIONS_SQL.format(chain=chain))
+            await conn.execute_query(DROP_COLUMNS_SQL.format(chain=chain))
+            logger.info(f"Moved users.{chain}_* columns into delegations.")
+    total = await Delegations.all().count()
+    logger.info(f"Delegations migrated, delegations now has {total} rows.")
+    return total
+
+
+async def main():
+    await Tortoise.init(
+        db_url=os.getenv('DATABASE_URL'),
+        modules={'models': ['models.models']}
+    )
+    await Tortoise.generate_schemas(safe=True)
+    await migrate_delegations()
+
+
+if __name__ == '__main__':
+    setup_logging()
+    run_async(main())
@@ -0,0 +1,49 @@
+import os
+import logging
+from services.logging_config import setup_logging
+from tortoise import Tortoise, run_async
+from tortoise.transactions import in_transaction
+from models.models import UniqueLinks
+from services.unique_links import UNIQUE_LINK_TTL
+
+logger = logging.getLogger(__name__)
+
+COLUMN_EXISTS_SQL = """
+SELECT 1 FROM information_schema.columns
+WHERE table_name = 'users' AND column_name = 'used_unique_links'
+"""
+
+COPY_LINKS_SQL = """
+INSERT INTO unique_links (link_id, telegram_id, used, created_at, expires_at)
+SELECT l.key, u.telegram_id, l.value::boolean, now(), now() + $1::interval
+FROM users AS u, jsonb_each_text(u.used_unique_links::jsonb) AS l
+ON CONFLICT (link_id) DO NOTHING
+"""
+
+
+async def migrate_unique_links():
+    """Move links from the users.used_unique_links JSON column into unique_links."""
+    async with in_transaction() as conn:
+        _, rows = await conn.execute_query(COLUMN_EXISTS_SQL)
+        if not rows:
+            logger.info("users.used_unique_links does not exist, nothing to migrate.")
+            return 0
+        await conn.execute_query(COPY_LINKS_SQL, [UNIQUE_LINK_TTL])
+        await conn.execute_query("ALTER TABLE users DROP COLUMN used_unique_links")
+    total = await UniqueLinks.all().count()
+    logger.info(f"Links moved, unique_links now has {total} rows.")
+    return total
+
+
+async def main():
+    await Tortoise.init(
+        db_url=os.getenv('DATABASE_URL'),
+        modules={'models': ['models.models']}
+    )
+    await Tortoise.generate_schemas(safe=True)
+    await migrate_unique_links()
+
+
+if __name__ == '__main__':
+    setup_logging()
+    run_async(main())
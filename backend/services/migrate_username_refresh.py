@@ -0,0 +1,34 @@
+import os
+import logging
+from services.logging_config import setup_logging
+from tortoise import Tortoise, connections, run_async
+
+logger = logging.getLogger(__name__)
+
+ADD_COLUMN_SQL = """
+ALTER TABLE users ADD COLUMN IF NOT EXISTS username_refreshed_at TIMESTAMPTZ NULL
+"""
+
+ADD_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS idx_users_username_refreshed_at ON users (username_refreshed_at)
+"""
+
+
+async def migrate_username_refresh():
+    """Add the users.username_refreshed_at column used by nickname_from_id."""
+    connection = connections.get("default")
+    await connection.execute_script(ADD_COLUMN_SQL + ";" + ADD_INDEX_SQL)
+    logger.info("users.username_refreshed_at is in place.")
+
+
+async def main():
+    await Tortoise.init(
+        db_url=os.getenv('DATABASE_URL'),
+        modules={'models': ['models.models']}
+    )
+    await migrate_username_refresh()
+
+
+if __name__ == '__main__':
+    setup_logging()
+    run_async(main())
@@ -0,0 +1,146 @@
+"""Versioned schema migrations.
+
+Applied versions are recorded in schema_migrations. On an empty database the
+schema is generated from the models and every version is stamped as applied,
+since the data migrations only exist to upgrade older deployments. Databases
+created before this table existed run the pending migrations in order; each
+one is safe to re-run.
+
+Migrations run under a Postgres advisory lock, so replicas starting at the
+same time apply them once, and each migration commits together with its
+schema_migrations row.
+
+Add new tables, columns or data changes as a new entry at the end of
+MIGRATIONS, never by editing an applied one.
+
+``python -m services.migrations`` applies pending migrations (the release step
+for STARTUP_MODE=production), ``--status`` only lists them.
+"""
+import os
+import argparse
+import logging
+from contextlib import asynccontextmanager
+from tortoise import Tortoise, connections, run_async
+from tortoise.transactions import in_transaction
+from models.models import SchemaMigrations
+from services.db_config import tortoise_config, generate_primary_schemas
+from services.logging_config import setup_logging
+from services.migrate_unique_links import migrate_unique_links
+from services.migrate_delegations import migrate_delegations
+from services.migrate_username_refresh import migrate_username_refresh
+from services.migrate_delegation_verification import migrate_delegation_verification, migrate_verify_started_at
+from services.referral_ancestry import backfill_referral_ancestry
+from services.referral_stats import backfill_referral_stats
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = [
+    (1, "baseline schema", generate_primary_schemas),
+    (2, "move users.used_unique_links into unique_links", migrate_unique_links),
+    (3, "move users.<chain>_* columns into delegations", migrate_delegations),
+    (4, "add users.username_refreshed_at", migrate_username_refresh),
+    (5, "backfill referral_ancestry", backfill_referral_ancestry),
+    (6, "backfill referral_stats", backfill_referral_stats),
+    (7, "add delegations verification columns", migrate_delegation_verification),
+    (8, "add delegations.verify_started_at", migrate_verify_started_at),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+MIGRATION_LOCK_ID = int(os.getenv('MIGRATION_LOCK_ID', '724002'))
+
+CREATE_MIGRATIONS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INT NOT NULL PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    applied_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+
+async def table_exists(name: str) -> bool:
+    connection = connections.get("default")
+    if connection.capabilities.dialect == "sqlite":
+        _, rows = await connection.execute_query(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", [name])
+    else:
+        _, rows = await connection.execute_query(
+            "SELECT 1 FROM information_schema.tables WHERE table_name = $1", [name])
+    return bool(rows)
+
+
+async def applied_versions() -> set:
+    if not await table_exists("schema_migrations"):
+        return set()
+    return set(await SchemaMigrations.all().values_list("version", flat=True))
+
+
+async def pending_migrations() -> list:
+    applied = await applied_versions()
+    return [migration for migration in MIGRATIONS if migration[0] not in applied]
+
+
+@asynccontextmanager
+async def migration_lock():
+    """Hold a session advisory lock on a dedicated pool connection; other databases have one process."""
+    client = connections.get("default")
+    if client.capabilities.dialect != "postgres":
+        yield
+        return
+    async with client.acquire_connection() as connection:
+        await connection.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK_ID)
+        try:
+            yield
+        finally:
+            await connection.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_ID)
+
+
+async def apply_migrations() -> list:
+    """Bring the schema to LATEST_VERSION and return the versions that were applied.
+
+    Pending migrations are read only once the lock is held, so a process that
+    waited for another one finds nothing left to do.
+    """
+    async with migration_lock():
+        fresh = not await table_exists("users")
+        await connections.get("default").execute_script(CREATE_MIGRATIONS_TABLE_SQL)
+        pending = await pending_migrations()
+        if not pending:
+            return []
+
+        if fresh:
+            async with in_transaction():
+                await generate_primary_schemas()
+                await SchemaMigrations.bulk_create(
+                    [SchemaMigrations(version=version, name=name) for version, name, _ in pending])
+            logger.info(f"Created a new schema at version {LATEST_VERSION}.")
+            return [version for version, _, _ in pending]
+
+        for version, name, migrate in pending:
+            logger.info(f"Applying migration {version}: {name}")
+            async with in_transaction():
+                await migrate()
+                await SchemaMigrations.create(version=version, name=name)
+        logger.info(f"Schema migrated to version {LATEST_VERSION}.")
+        return [version for version, _, _ in pending]
+
+
+async def main(status: bool):
+    await Tortoise.init(config=tortoise_config())
+    try:
+        if status:
+            pending = await pending_migrations()
+            for version, name, _ in pending:
+                print(f"pending {version}: {name}")
+            print(f"{len(pending)} pending, latest version {LATEST_VERSION}")
+        else:
+            await apply_migrations()
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Apply versioned schema migrations.")
+    parser.add_argument('--status', action='store_true', help="List pending migrations without applying them")
+    setup_logging()
+    run_async(main(parser.parse_args().status))
@@ -1,42 +1,152 @@
 import os
 import json
+import asyncio
+import argparse
+from datetime import datetime, timedelta, timezone
 from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
 from tortoise import Tortoise, run_async
+from tortoise.expressions import Q
 from models.models import Users
+from services.db_config import tortoise_config, read_connection, generate_primary_schemas
 from dotenv import load_dotenv
 
 load_dotenv()
 
-bot = Bot(token=os.getenv('TG_BOT_TOKEN'))
+_bot = None
+
+
+def get_bot() -> Bot:
+    """The Bot used for getChat, created on first use so importing this module needs no token."""
+    global _bot
+    if _bot is None:
+        _bot = Bot(token=os.getenv('TG_BOT_TOKEN'))
+    return _bot
+
+
+class RateLimiter:
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self.next_slot = 0.0
+
+    async def wait(self):
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self.next_slot)
+        self.next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def pause(self, seconds: float):
+        now = asyncio.get_running_loop().time()
+        self.next_slot = max(self.next_slot, now + seconds)
 
 
 async def init():
-    await Tortoise.init(
-        db_url=os.getenv('DB_URL'),
-        modules={'models': ['models']}
-    )
-    await Tortoise.generate_schemas()
+    await Tortoise.init(config=tortoise_config(os.getenv('DATABASE_URL', os.getenv('DB_URL'))))
+    await generate_primary_schemas()
+
+
+def read_checkpoint(path: str) -> int:
+    try:
+        with open(path, 'r') as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
 
+def write_checkpoint(path: str, last_id: int):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(str(last_id))
+    os.replace(tmp_path, path)
 
-async def fetch_usernames():
+
+async def resolve_username(telegram_id: str, semaphore, limiter, retries: int = 3):
+    async with semaphore:
+        for attempt in range(retries + 1):
+            await limiter.wait()
+            try:
+                chat = await get_bot().get_chat(telegram_id)
+                return chat.username, True
+            except TelegramRetryAfter as e:
+                print(f"Flood control while fetching {telegram_id}, waiting {e.retry_after}s")
+                limiter.pause(e.retry_after)
+            except Exception as e:
+                print(f"Failed to fetch username for ID {telegram_id}: {e}")
+                return None, False
+        return None, False
+
+
+async def fetch_usernames(output='user_usernames.jsonl', checkpoint='user_usernames.checkpoint',
+                          write_db=True, concurrency=10, rate=25.0, page_size=500, ttl_hours=24.0,
+                          reset=False):
+    """Resolve usernames page by page and stream them to JSONL and/or Users.username.
+
+    Users are read with keyset pagination on id. The last finished id is
+    checkpointed after every page, so an interrupted run resumes where it
+    stopped. Users refreshed within ttl_hours are skipped.
+    """
     await init()
-    users = await Users.all()
-    id_nickname_map = {}
+    if reset and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    last_id = read_checkpoint(checkpoint)
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=ttl_hours)
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = RateLimiter(rate)
+    resolved = failed = 0
+
+    with open(output, 'a', encoding='utf-8') as out:
+        while True:
+            users = await Users.filter(id__gt=last_id).using_db(read_connection()).filter(
+                Q(username_refreshed_at__isnull=True) | Q(username_refreshed_at__lt=cutoff)
+            ).order_by("id").limit(page_size)
+            if not users:
+                break
 
-    for user in users:
-        user_id = user.telegram_id
-        try:
-            user = await bot.get_chat(user_id)
-            id_nickname_map[user_id] = user.username if user.username else "No username"
-        except Exception as e:
-            print(f"Failed to fetch username for ID {user_id}: {e}")
-            id_nickname_map[user_id] = "Failed to fetch"
+            results = await asyncio.gather(
+                *(resolve_username(user.telegram_id, semaphore, limiter) for user in users))
 
-    with open('user_usernames.json', 'w') as f:
-        json.dump(id_nickname_map, f, ensure_ascii=False, indent=4)
+            refreshed = []
+            now = datetime.now(timezone.utc)
+            for user, (username, ok) in zip(users, results):
+                if ok:
+                    resolved += 1
+                    out.write(json.dumps({user.telegram_id: username or "No username"}, ensure_ascii=False) + "\n")
+                    if username:
+                        user.username = username
+                    user.username_refreshed_at = now
+                    refreshed.append(user)
+                else:
+                    failed += 1
+                    out.write(json.dumps({user.telegram_id: "Failed to fetch"}, ensure_ascii=False) + "\n")
+            out.flush()
 
+            if write_db and refreshed:
+                await Users.bulk_update(refreshed, fields=["username", "username_refreshed_at"])
+
+            last_id = users[-1].id
+            write_checkpoint(checkpoint, last_id)
+            print(f"Processed users up to id {last_id}: {resolved} resolved, {failed} failed")
+
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    if _bot is not None:
+        await _bot.session.close()
     await Tortoise.close_connections()
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Resolve Telegram usernames for all users.")
+    parser.add_argument('--output', default='user_usernames.jsonl')
+    parser.add_argument('--checkpoint', default='user_usernames.checkpoint')
+    parser.add_argument('--no-db', dest='write_db', action='store_false', help="Do not write Users.username")
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--rate', type=float, default=25.0, help="Maximum getChat calls per second")
+    parser.add_argument('--page-size', type=int, default=500)
+    parser.add_argument('--ttl-hours', type=float, default=24.0, help="Skip users refreshed more recently")
+    parser.add_argument('--reset', action='store_true', help="Ignore an existing checkpoint")
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    run_async(fetch_usernames())
+    run_async(fetch_usernames(**vars(parse_args())))
@@ -0,0 +1,96 @@
+import logging
+from services.logging_config import setup_logging
+from tortoise import Tortoise, connections, run_async
+from tortoise.transactions import in_transaction
+from models.models import ReferralAncestry
+from services.db_config import read_connection, tortoise_config
+
+logger = logging.getLogger(__name__)
+
+# Links every ancestor of the referrer (and the referrer itself) to the new
+# user and to any users that were already referred by the new user, and
+# returns the links it actually inserted.
+ATTACH_SQL = """
+INSERT INTO referral_ancestry (ancestor_id, descendant_id, depth)
+SELECT a.ancestor_id, d.descendant_id, a.depth + d.depth
+FROM (
+    SELECT ancestor_id, depth + 1 AS depth FROM referral_ancestry WHERE descendant_id = $1
+    UNION ALL
+    SELECT $1::varchar, 1
+) a
+CROSS JOIN (
+    SELECT descendant_id, depth FROM referral_ancestry WHERE ancestor_id = $2
+    UNION ALL
+    SELECT $2::varchar, 0
+) d
+WHERE a.ancestor_id <> d.descendant_id
+ON CONFLICT (ancestor_id, descendant_id) DO NOTHING
+RETURNING ancestor_id, descendant_id, depth
+"""
+
+BACKFILL_SQL = """
+WITH RECURSIVE chain AS (
+    SELECT u.ref_id AS ancestor_id, u.telegram_id AS descendant_id, 1 AS depth,
+           ARRAY[u.telegram_id::varchar, u.ref_id::varchar] AS path
+    FROM users u
+    WHERE u.ref_type IN ('user', 'developer')
+      AND u.ref_id <> u.telegram_id
+    UNION ALL
+    SELECT u.ref_id, c.descendant_id, c.depth + 1,
+           c.path || u.ref_id::varchar
+    FROM chain c
+    JOIN users u ON u.telegram_id = c.ancestor_id
+    WHERE u.ref_type IN ('user', 'developer')
+      AND NOT u.ref_id = ANY(c.path)
+)
+INSERT INTO referral_ancestry (ancestor_id, descendant_id, depth)
+SELECT ancestor_id, descendant_id, depth FROM chain
+ON CONFLICT (ancestor_id, descendant_id) DO NOTHING
+"""
+
+
+async def attach_referral(ref_id: str, telegram_id: str, using_db=None) -> list:
+    """Link the new user into the closure table and return the inserted (ancestor_id, descendant_id, depth)."""
+    connection = using_db or connections.get("default")
+    _, rows = await connection.execute_query(ATTACH_SQL, [ref_id, telegram_id])
+    return [(row["ancestor_id"], row["descendant_id"], row["depth"]) for row in rows]
+
+
+async def get_uplines(telegram_id: str) -> list:
+    return await ReferralAncestry.filter(descendant_id=telegram_id).using_db(read_connection()).order_by(
+        "depth").values_list("ancestor_id", flat=True)
+
+
+async def get_downline(telegram_id: str, max_depth: int = None) -> list:
+    query = ReferralAncestry.filter(ancestor_id=telegram_id).using_db(read_connection())
+    if max_depth is not None:
+        query = query.filter(depth__lte=max_depth)
+    return await query.order_by("depth").values("descendant_id", "depth")
+
+
+async def count_descendants(telegram_id: str) -> int:
+    return await ReferralAncestry.filter(ancestor_id=telegram_id).using_db(read_connection()).count()
+
+
+async def is_in_downline(ancestor_id: str, telegram_id: str) -> bool:
+    return await ReferralAncestry.filter(ancestor_id=ancestor_id, descendant_id=telegram_id).using_db(
+        read_connection()).exists()
+
+
+async def backfill_referral_ancestry():
+    async with in_transaction() as conn:
+        await conn.execute_query("DELETE FROM referral_ancestry")
+        await conn.execute_query(BACKFILL_SQL)
+    total = await ReferralAncestry.all().count()
+    logger.info(f"Referral ancestry backfilled, {total} rows.")
+    return total
+
+
+async def main():
+    await Tortoise.init(config=tortoise_config())
+    await backfill_referral_ancestry()
+
+
+if __name__ == '__main__':
+    setup_logging()
+    run_async(main())
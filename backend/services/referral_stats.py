@@ -0,0 +1,191 @@
+import os
+import re
+import time
+import logging
+from collections import OrderedDict
+from tortoise import Tortoise, connections, run_async
+from tortoise.transactions import in_transaction
+from models.models import ReferralStats
+from services.db_config import read_connection, tortoise_config
+from services.logging_config import setup_logging
+
+logger = logging.getLogger(__name__)
+
+STATS_CACHE_SIZE = int(os.getenv('STATS_CACHE_SIZE', '1000'))
+STATS_CACHE_TTL = float(os.getenv('STATS_CACHE_TTL', '30'))
+LEADERBOARD_MAX_LIMIT = int(os.getenv('LEADERBOARD_MAX_LIMIT', '100'))
+
+METRIC_RE = re.compile(r"^(direct|total|level:\d+|delegations:[a-z0-9_-]+)$")
+
+# Counters are kept per (referrer_id, metric):
+#   direct              users referred directly
+#   total               users anywhere in the downline
+#   level:<ref_level>   downline users with that ref_level
+#   delegations:<chain> downline users with a successful delegation on that chain
+# Every ancestor in referral_ancestry is a referrer, developer codes included.
+
+# Counts exactly the ancestry links attach_referral inserted, with the same
+# rules as BACKFILL_SQL, so the counters never drift from a full backfill.
+RECORD_LINKS_SQL = """
+WITH l AS (
+    SELECT * FROM unnest($1::varchar[], $2::varchar[], $3::int[]) AS l(ancestor_id, descendant_id, depth)
+)
+INSERT INTO referral_stats (referrer_id, metric, value)
+SELECT l.ancestor_id, m.metric, count(*)
+FROM l
+JOIN users u ON u.telegram_id = l.descendant_id
+CROSS JOIN LATERAL (
+    VALUES ('total'), ('level:' || u.ref_level::text), (CASE WHEN l.depth = 1 THEN 'direct' END)
+) AS m(metric)
+WHERE m.metric IS NOT NULL
+GROUP BY l.ancestor_id, m.metric
+UNION ALL
+SELECT l.ancestor_id, 'delegations:' || d.chain, count(*)
+FROM l
+JOIN delegations d ON d.telegram_id = l.descendant_id
+WHERE d.tx IS NOT NULL
+GROUP BY l.ancestor_id, d.chain
+ON CONFLICT (referrer_id, metric) DO UPDATE SET value = referral_stats.value + EXCLUDED.value
+"""
+
+BACKFILL_SQL = """
+INSERT INTO referral_stats (referrer_id, metric, value)
+SELECT a.ancestor_id, m.metric, count(*)
+FROM referral_ancestry a
+JOIN users u ON u.telegram_id = a.descendant_id
+CROSS JOIN LATERAL (
+    VALUES ('total'), ('level:' || u.ref_level::text), (CASE WHEN a.depth = 1 THEN 'direct' END)
+) AS m(metric)
+WHERE m.metric IS NOT NULL
+GROUP BY a.ancestor_id, m.metric
+UNION ALL
+SELECT a.ancestor_id, 'delegations:' || d.chain, count(*)
+FROM referral_ancestry a
+JOIN delegations d ON d.telegram_id = a.descendant_id
+WHERE d.tx IS NOT NULL
+GROUP BY a.ancestor_id, d.chain
+"""
+
+LEADERBOARD_SQL = """
+SELECT s.referrer_id, s.value, u.username, u.firstname
+FROM referral_stats s
+LEFT JOIN users u ON u.telegram_id = s.referrer_id
+WHERE s.metric = $1
+ORDER BY s.value DESC, s.referrer_id
+LIMIT $2 OFFSET $3
+"""
+
+
+class StatsCache:
+    """Small LRU cache with a TTL for computed stats responses."""
+
+    def __init__(self, maxsize=STATS_CACHE_SIZE, ttl=STATS_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+stats_cache = StatsCache()
+
+
+def is_valid_metric(metric: str) -> bool:
+    return bool(METRIC_RE.match(metric))
+
+
+async def record_links(links: list, using_db=None):
+    """Count the (ancestor_id, descendant_id, depth) links returned by attach_referral.
+
+    Besides the new user's ancestors, this covers the users the new user had
+    already referred, which join the upline's downline at the same time. Must
+    run in the same transaction as attach_referral.
+    """
+    if not links:
+        return
+    connection = using_db or connections.get("default")
+    await connection.execute_query(RECORD_LINKS_SQL, [list(column) for column in zip(*links)])
+
+
+async def get_referrer_stats(referrer_id: str) -> dict:
+    cached = stats_cache.get(("referrer", referrer_id))
+    if cached is not None:
+        return cached
+
+    rows = await ReferralStats.filter(referrer_id=referrer_id).using_db(read_connection()).values_list(
+        "metric", "value")
+    stats = {"referrer_id": referrer_id, "direct_referrals": 0, "total_referrals": 0, "levels": {},
+             "delegations": {}}
+    for metric, value in rows:
+        if metric == "direct":
+            stats["direct_referrals"] = value
+        elif metric == "total":
+            stats["total_referrals"] = value
+        elif metric.startswith("level:"):
+            stats["levels"][metric[len("level:"):]] = value
+        elif metric.startswith("delegations:"):
+            stats["delegations"][metric[len("delegations:"):]] = value
+    stats_cache.put(("referrer", referrer_id), stats)
+    return stats
+
+
+async def get_leaderboard(metric: str = "total", limit: int = 20, offset: int = 0) -> dict:
+    key = ("leaderboard", metric, limit, offset)
+    cached = stats_cache.get(key)
+    if cached is not None:
+        return cached
+
+    connection = read_connection()
+    rows = await connection.execute_query_dict(LEADERBOARD_SQL, [metric, limit, offset])
+    total = await ReferralStats.filter(metric=metric).using_db(connection).count()
+    leaderboard = {
+        "metric": metric,
+        "total": total,
+        "limit": limit,
+        "offset": offset,
+        "items": [
+            {"rank": offset + position, "referrer_id": row["referrer_id"], "value": row["value"],
+             "username": row["username"], "firstname": row["firstname"]}
+            for position, row in enumerate(rows, 1)
+        ],
+    }
+    stats_cache.put(key, leaderboard)
+    return leaderboard
+
+
+async def backfill_referral_stats():
+    async with in_transaction() as conn:
+        await conn.execute_query("DELETE FROM referral_stats")
+        await conn.execute_query(BACKFILL_SQL)
+    total = await ReferralStats.all().count()
+    logger.info(f"Referral stats backfilled, {total} counters.")
+    stats_cache.clear()
+    return total
+
+
+async def main():
+    await Tortoise.init(config=tortoise_config())
+    await backfill_referral_stats()
+
+
+if __name__ == '__main__':
+    setup_logging()
+    run_async(main())
@@ -1,63 +1,225 @@
 from fastapi import HTTPException
-from models.models import Users
+from tortoise import connections
+from services.delegation_dedup import delegation_dedup
 import logging
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# A tx is only applied the first time it is reported for a user and chain:
+# the delegation_txs unique index decides, and a repeated tx returns the stored
+# row with duplicate = TRUE instead of writing it again. Reports without a tx
+# (failures) are always applied. A newly stored tx is queued for on-chain
+# verification by resetting verification_status to 'pending' and verify_started_at,
+# which failure reports leave alone.
+# The first successful tx of a user on a chain also bumps the delegations:<chain>
+# referral stats of all their ancestors, in the same statement. It is counted
+# when the row was newly inserted (xmax = 0) or the existing row had no tx yet.
+# previous is joined into saved so its FOR UPDATE runs before the upsert: a
+# concurrent report waits there and reads the committed row, so two first
+# reports cannot both count.
+UPSERT_DELEGATION_SQL = """
+WITH seen AS (
+    INSERT INTO delegation_txs (telegram_id, chain, tx, created_at)
+    SELECT u.telegram_id, $2, $4, now()
+    FROM users AS u
+    WHERE u.telegram_id = $1
+      AND $4::varchar IS NOT NULL
+    ON CONFLICT (telegram_id, chain, tx) DO NOTHING
+    RETURNING tx
+), previous AS (
+    SELECT tx FROM delegations WHERE telegram_id = $1 AND chain = $2 FOR UPDATE
+), saved AS (
+    INSERT INTO delegations (telegram_id, chain, address, tx, tx_error, verification_status, verify_started_at,
+                             created_at, updated_at)
+    SELECT u.telegram_id, $2, $3, $4, $5, CASE WHEN $4::varchar IS NOT NULL THEN 'pending' END,
+           CASE WHEN $4::varchar IS NOT NULL THEN now() END, now(), now()
+    FROM users AS u
+    LEFT JOIN previous ON TRUE
+    WHERE u.telegram_id = $1
+      AND ($4::varchar IS NULL OR EXISTS (SELECT 1 FROM seen))
+    ON CONFLICT (telegram_id, chain) DO UPDATE SET
+        address = EXCLUDED.address,
+        tx = COALESCE(EXCLUDED.tx, delegations.tx),
+        tx_error = COALESCE(EXCLUDED.tx_error, delegations.tx_error),
+        verification_status = COALESCE(EXCLUDED.verification_status, delegations.verification_status),
+        verified_amount = CASE WHEN EXCLUDED.tx IS NULL THEN delegations.verified_amount END,
+        verification_error = CASE WHEN EXCLUDED.tx IS NULL THEN delegations.verification_error END,
+        verification_checked_at = CASE WHEN EXCLUDED.tx IS NULL THEN delegations.verification_checked_at END,
+        verify_started_at = COALESCE(EXCLUDED.verify_started_at, delegations.verify_started_at),
+        updated_at = now()
+    RETURNING telegram_id, chain, address, tx, tx_error, xmax = 0 AS inserted
+), counted AS (
+    INSERT INTO referral_stats (referrer_id, metric, value)
+    SELECT a.ancestor_id, 'delegations:' || s.chain, 1
+    FROM saved s
+    JOIN referral_ancestry a ON a.descendant_id = s.telegram_id
+    WHERE s.tx IS NOT NULL
+      AND (s.inserted OR EXISTS (SELECT 1 FROM previous WHERE tx IS NULL))
+    ON CONFLICT (referrer_id, metric) DO UPDATE SET value = referral_stats.value + EXCLUDED.value
+)
+SELECT telegram_id, chain, address, tx, tx_error, FALSE AS duplicate FROM saved
+UNION ALL
+SELECT telegram_id, chain, address, tx, tx_error, TRUE AS duplicate
+FROM delegations
+WHERE telegram_id = $1 AND chain = $2
+  AND NOT EXISTS (SELECT 1 FROM saved)
+"""
 
-async def save_user_delegation_tia(telegram_id: str, address: str, tx: str, tx_error) -> str:
+
+async def save_user_delegation(chain: str, telegram_id: str, address: str, tx: str, tx_error):
+    """Store the user's delegation for one chain and return it in a single statement.
+
+    A successful tx only replaces the stored tx, a failed one only the stored
+    tx_error, so a later failure does not hide an earlier delegation. A tx
+    that was already reported is answered from the dedup cache or, failing
+    that, from the stored row, without a write.
+    """
     try:
-        user = await get_user(telegram_id)
-        if tx:
-            user.tia_address = address
-            user.tia_tx = tx
-        else:
-            user.tia_address = address
-            user.tia_tx_error = tx_error
-        await user.save()
-        user = await Users.get_or_none(telegram_id=telegram_id)
-        return [user.telegram_id, user.tia_address, user.tia_tx, user.tia_tx_error]
+        cached = delegation_dedup.get(telegram_id, chain, tx)
+        if cached:
+            return [cached["telegram_id"], cached["address"], cached["tx"], cached["tx_error"]]
+
+        values = [telegram_id, chain, address, tx or None, None if tx else tx_error]
+        connection = connections.get("default")
+        rows = await connection.execute_query_dict(UPSERT_DELEGATION_SQL, values)
+
+        if not rows:
+            logger.error(f"User {telegram_id} not found.")
+            raise HTTPException(
+                status_code=403, detail=f"User {telegram_id} not found.")
+
+        row = rows[0]
+        delegation_dedup.put(telegram_id, chain, tx, row)
+        return [row["telegram_id"], row["address"], row["tx"], row["tx_error"]]
 
     except HTTPException as e:
         logger.error(f"HTTP Exception: {e.detail}")
         raise e
 
     except Exception as e:
-        logger.error(f"Error saving TIA delegation: {e}")
+        logger.error(f"Error saving {chain} delegation: {e}")
         raise HTTPException(
-            status_code=500, detail="An error occurred while saving TIA delegation.")
+            status_code=500, detail=f"An error occurred while saving {chain} delegation.")
 
 
-async def save_user_delegation_fet(telegram_id: str, address: str, tx: str, tx_error):
-    try:
-        user = await get_user(telegram_id)
-        if tx:
-            user.fet_address = address
-            user.fet_tx = tx
-        else:
-            user.fet_address = address
-            user.fet_tx_error = tx_error
-        await user.save()
-        user = await Users.get_or_none(telegram_id=telegram_id)
-        return [user.telegram_id, user.fet_address, user.fet_tx, user.fet_tx_error]
+BULK_UPSERT_DELEGATIONS_SQL = """
+WITH d AS (
+    SELECT *
+    FROM unnest($1::varchar[], $2::varchar[], $3::varchar[], $4::varchar[], $5::varchar[])
+         AS d(telegram_id, chain, address, tx, tx_error)
+), seen AS (
+    INSERT INTO delegation_txs (telegram_id, chain, tx, created_at)
+    SELECT d.telegram_id, d.chain, d.tx, now()
+    FROM d
+    JOIN users AS u ON u.telegram_id = d.telegram_id
+    WHERE d.tx IS NOT NULL
+    ON CONFLICT (telegram_id, chain, tx) DO NOTHING
+    RETURNING telegram_id, chain
+), previous AS (
+    SELECT p.telegram_id, p.chain, p.tx
+    FROM delegations p
+    JOIN d ON p.telegram_id = d.telegram_id AND p.chain = d.chain
+    FOR UPDATE OF p
+), saved AS (
+    INSERT INTO delegations (telegram_id, chain, address, tx, tx_error, verification_status, verify_started_at,
+                             created_at, updated_at)
+    SELECT d.telegram_id, d.chain, d.address, d.tx, d.tx_error, CASE WHEN d.tx IS NOT NULL THEN 'pending' END,
+           CASE WHEN d.tx IS NOT NULL THEN now() END, now(), now()
+    FROM d
+    JOIN users AS u ON u.telegram_id = d.telegram_id
+    LEFT JOIN previous p ON p.telegram_id = d.telegram_id AND p.chain = d.chain
+    WHERE d.tx IS NULL
+       OR EXISTS (SELECT 1 FROM seen s WHERE s.telegram_id = d.telegram_id AND s.chain = d.chain)
+    ON CONFLICT (telegram_id, chain) DO UPDATE SET
+        address = EXCLUDED.address,
+        tx = COALESCE(EXCLUDED.tx, delegations.tx),
+        tx_error = COALESCE(EXCLUDED.tx_error, delegations.tx_error),
+        verification_status = COALESCE(EXCLUDED.verification_status, delegations.verification_status),
+        verified_amount = CASE WHEN EXCLUDED.tx IS NULL THEN delegations.verified_amount END,
+        verification_error = CASE WHEN EXCLUDED.tx IS NULL THEN delegations.verification_error END,
+        verification_checked_at = CASE WHEN EXCLUDED.tx IS NULL THEN delegations.verification_checked_at END,
+        verify_started_at = COALESCE(EXCLUDED.verify_started_at, delegations.verify_started_at),
+        updated_at = now()
+    RETURNING telegram_id, chain, address, tx, tx_error, xmax = 0 AS inserted
+), counted AS (
+    INSERT INTO referral_stats (referrer_id, metric, value)
+    SELECT a.ancestor_id, 'delegations:' || s.chain, count(*)
+    FROM saved s
+    JOIN referral_ancestry a ON a.descendant_id = s.telegram_id
+    WHERE s.tx IS NOT NULL
+      AND (s.inserted OR EXISTS (
+          SELECT 1 FROM previous p WHERE p.telegram_id = s.telegram_id AND p.chain = s.chain AND p.tx IS NULL))
+    GROUP BY a.ancestor_id, s.chain
+    ON CONFLICT (referrer_id, metric) DO UPDATE SET value = referral_stats.value + EXCLUDED.value
+)
+SELECT telegram_id, chain, address, tx, tx_error, FALSE AS duplicate FROM saved
+UNION ALL
+SELECT p.telegram_id, p.chain, p.address, p.tx, p.tx_error, TRUE AS duplicate
+FROM delegations p
+JOIN d ON p.telegram_id = d.telegram_id AND p.chain = d.chain
+WHERE NOT EXISTS (SELECT 1 FROM saved s WHERE s.telegram_id = d.telegram_id AND s.chain = d.chain)
+"""
 
-    except HTTPException as e:
-        logger.error(f"HTTP Exception: {e.detail}")
-        raise e
 
-    except Exception as e:
-        logger.error(f"Error saving FET delegation: {e}")
-        raise HTTPException(
-            status_code=500, detail="An error occurred while saving FET delegation.")
+def split_waves(records) -> list:
+    """Split (chain, telegram_id, address, tx, tx_error) records into waves with one record per user and chain.
 
+    Wave k holds the k-th record of every user and chain, in order, each as
+    a (position in records, upsert record) pair. One upsert statement cannot
+    touch the same row twice, and collapsing records would drop earlier txs
+    before they reach delegation_txs, so each wave is applied with its own
+    statement instead.
+    """
+    waves = []
+    counts = {}
+    for position, (chain, telegram_id, address, tx, tx_error) in enumerate(records):
+        tx, tx_error = (tx, None) if tx else (None, tx_error)
+        wave = counts.get((telegram_id, chain), 0)
+        counts[(telegram_id, chain)] = wave + 1
+        if wave == len(waves):
+            waves.append([])
+        waves[wave].append((position, (telegram_id, chain, address, tx, tx_error)))
+    return waves
 
-async def get_user(telegram_id: str):
-    user = await Users.get_or_none(telegram_id=telegram_id)
 
-    if not user:
-        logger.error(f"User {telegram_id} not found.")
-        raise HTTPException(
-            status_code=403, detail=f"User {telegram_id} not found.")
+async def save_user_delegations_bulk(records) -> list:
+    """Upsert many delegation records, one statement per wave, and return one row per record.
+
+    The result is aligned with records: the stored row, with duplicate set
+    for a tx that was already reported, or None for an unknown user. Every
+    tx is recorded in delegation_txs in report order, so a later
+    resubmission of any of them is a duplicate. Records whose tx is in the
+    dedup cache are answered from it.
+    """
+    results = [None] * len(records)
+    for wave in split_waves(records):
+        rows = await save_wave([record for _, record in wave])
+        for (position, _), row in zip(wave, rows):
+            results[position] = row
+    return results
+
+
+async def save_wave(wave: list) -> list:
+    """Apply one wave and return its rows in wave order, None where the user is unknown."""
+    rows = [None] * len(wave)
+    fresh = []
+    for index, (telegram_id, chain, _, tx, _) in enumerate(wave):
+        cached = delegation_dedup.get(telegram_id, chain, tx)
+        if cached:
+            rows[index] = {**cached, "duplicate": True}
+        else:
+            fresh.append(index)
+    if not fresh:
+        return rows
 
-    return user
+    columns = [list(column) for column in zip(*(wave[index] for index in fresh))]
+    connection = connections.get("default")
+    saved = await connection.execute_query_dict(BULK_UPSERT_DELEGATIONS_SQL, columns)
+    by_key = {(row["telegram_id"], row["chain"]): row for row in saved}
+    for index in fresh:
+        telegram_id, chain, _, tx, _ = wave[index]
+        row = by_key.get((telegram_id, chain))
+        if row:
+            rows[index] = row
+            delegation_dedup.put(telegram_id, chain, tx, row)
+    return rows
@@ -0,0 +1,83 @@
+import os
+import time
+import asyncio
+import logging
+from contextlib import contextmanager
+from tortoise import connections
+from services.migrations import apply_migrations, pending_migrations
+
+logger = logging.getLogger(__name__)
+
+# dev applies pending migrations on boot; production only checks for them and
+# refuses to start, so migrations run once as a release step
+# (python -m services.migrations) instead of in every replica.
+STARTUP_MODE = os.getenv('STARTUP_MODE', 'dev')
+HEALTH_DB_TIMEOUT = float(os.getenv('HEALTH_DB_TIMEOUT', '2'))
+
+
+class StartupTimer:
+    """Wall-clock time of each startup step, logged as one line once startup is done."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.steps = []
+        self.completed = False
+
+    def mark(self, name: str):
+        """Record the time since the previous step, e.g. for module imports."""
+        now = time.perf_counter()
+        self.steps.append((name, now - self._last))
+        self._last = now
+
+    @contextmanager
+    def step(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._last = time.perf_counter()
+            self.steps.append((name, self._last - started))
+
+    def finish(self):
+        self.completed = True
+        total = time.perf_counter() - self.started
+        breakdown = ", ".join(f"{name} {duration * 1000:.0f}ms" for name, duration in self.steps)
+        logger.info("Startup finished in %.0fms (%s mode): %s", total * 1000, STARTUP_MODE, breakdown)
+
+    def as_dict(self) -> dict:
+        return {name: round(duration, 4) for name, duration in self.steps}
+
+
+startup_timer = StartupTimer()
+
+
+async def prepare_schema():
+    if STARTUP_MODE != "production":
+        await apply_migrations()
+        return
+    pending = await pending_migrations()
+    if pending:
+        versions = ", ".join(str(version) for version, _, _ in pending)
+        logger.error(f"Schema migrations {versions} are pending; run python -m services.migrations first.")
+        raise RuntimeError(f"Pending schema migrations: {versions}")
+
+
+def pool_stats() -> dict:
+    """Size of every asyncpg pool that has been opened; SQLite and unopened clients report none."""
+    stats = {}
+    for name in connections.db_config:
+        pool = getattr(connections.get(name), "_pool", None)
+        if pool is not None and hasattr(pool, "get_size"):
+            stats[name] = {"size": pool.get_size(), "idle": pool.get_idle_size(),
+                           "min": pool.get_min_size(), "max": pool.get_max_size()}
+    return stats
+
+
+async def check_database(timeout: float = HEALTH_DB_TIMEOUT) -> dict:
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(connections.get("default").execute_query("SELECT 1"), timeout)
+    except Exception as e:
+        return {"ok": False, "error": str(e) or type(e).__name__}
+    return {"ok": True, "latency_ms": round((time.perf_counter() - started) * 1000, 1), "pools": pool_stats()}
@@ -0,0 +1,376 @@
+"""Background on-chain verification of reported delegation txs.
+
+Delegations with a newly stored tx have verification_status 'pending'. The
+verifier takes a batch of them per pass and looks their txs up on the chain's
+Tendermint RPC (rpcUrl in the validator registry). Lookups are grouped into
+JSON-RPC batch calls, run with bounded concurrency over one keep-alive HTTP
+session and answered from an LRU cache of committed txs when possible.
+
+A tx is 'verified' when it succeeded, its memo ends with the reporting user's
+encoded id between the chain's memoVal and memoChain (as the frontend builds
+it), and it either grants the chain's validator address an authorization from
+the reported address or delegates/redelegates to the chain's validatorValoper;
+delegated amounts are recorded when the tx carries them. A (chain, tx) is only
+ever verified for one user. Txs the node does not know yet stay pending and are
+retried every TX_VERIFY_RETRY_INTERVAL seconds until TX_VERIFY_GIVE_UP_AFTER
+after the tx was reported, then marked 'failed'.
+
+Run one pass by hand, e.g. against bench/fake_chain_rpc.py, with
+``python -m services.tx_verifier --once``.
+"""
+import os
+import re
+import json
+import base64
+import asyncio
+import logging
+import argparse
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta, timezone
+import aiohttp
+from tortoise import Tortoise, connections, run_async
+from tortoise.expressions import Q
+from models.models import Delegations
+from services.chain_registry import get_chain
+from services.encode_decode_id import encode_id
+from services.db_config import tortoise_config
+from services.logging_config import setup_logging
+from services.metrics import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+TX_VERIFY_ENABLED = os.getenv('TX_VERIFY_ENABLED', 'true').lower() == 'true'
+TX_VERIFY_INTERVAL = float(os.getenv('TX_VERIFY_INTERVAL', '30'))
+TX_VERIFY_BATCH_SIZE = int(os.getenv('TX_VERIFY_BATCH_SIZE', '200'))
+TX_VERIFY_RPC_BATCH = int(os.getenv('TX_VERIFY_RPC_BATCH', '20'))
+TX_VERIFY_CONCURRENCY = int(os.getenv('TX_VERIFY_CONCURRENCY', '4'))
+TX_VERIFY_TIMEOUT = float(os.getenv('TX_VERIFY_TIMEOUT', '10'))
+TX_VERIFY_CACHE_SIZE = int(os.getenv('TX_VERIFY_CACHE_SIZE', '10000'))
+TX_VERIFY_RETRY_INTERVAL = float(os.getenv('TX_VERIFY_RETRY_INTERVAL', '60'))
+TX_VERIFY_GIVE_UP_AFTER = float(os.getenv('TX_VERIFY_GIVE_UP_AFTER', '3600'))
+
+PENDING, VERIFIED, FAILED = "pending", "verified", "failed"
+
+GRANT_EVENT = "cosmos.authz.v1beta1.EventGrant"
+TX_HASH_RE = re.compile(r"^(0x)?[0-9a-fA-F]{64}$")
+AMOUNT_RE = re.compile(r"^(\d+)([a-zA-Z][a-zA-Z0-9/:._-]*)$")
+ATTRIBUTE_KEY_RE = re.compile(r"^[a-z_.]+$")
+
+# A tx already verified for another user on the same chain is never verified again.
+RECORD_RESULTS_SQL = """
+WITH v AS (
+    SELECT *
+    FROM unnest($1::int[], $2::varchar[], $3::varchar[], $4::varchar[], $5::varchar[])
+         AS v(id, tx, status, amount, error)
+), claimed AS (
+    SELECT v.id
+    FROM v
+    JOIN delegations d ON d.id = v.id
+    WHERE v.status = 'verified'
+      AND EXISTS (
+          SELECT 1 FROM delegations o
+          WHERE o.id <> d.id
+            AND o.chain = d.chain
+            AND upper(o.tx) = upper(d.tx)
+            AND o.verification_status = 'verified'
+      )
+)
+UPDATE delegations AS d
+SET verification_status = CASE WHEN c.id IS NULL THEN v.status ELSE 'failed' END,
+    verified_amount = CASE WHEN c.id IS NULL THEN v.amount END,
+    verification_error = CASE WHEN c.id IS NULL THEN v.error ELSE 'tx already verified for another user' END,
+    verification_checked_at = now()
+FROM v
+LEFT JOIN claimed c ON c.id = v.id
+WHERE d.id = v.id
+  AND d.tx = v.tx
+  AND d.verification_status = 'pending'
+"""
+
+
+class TxResultCache:
+    """LRU cache of committed tx results; a committed tx never changes, so entries do not expire."""
+
+    def __init__(self, maxsize=TX_VERIFY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, rpc_url: str, tx_hash: str):
+        result = self._entries.get((rpc_url, tx_hash))
+        if result is None:
+            self.misses += 1
+            CACHE_REQUESTS.labels("tx_result", "miss").inc()
+            return None
+        self._entries.move_to_end((rpc_url, tx_hash))
+        self.hits += 1
+        CACHE_REQUESTS.labels("tx_result", "hit").inc()
+        return result
+
+    def put(self, rpc_url: str, tx_hash: str, result: dict):
+        self._entries[(rpc_url, tx_hash)] = result
+        self._entries.move_to_end((rpc_url, tx_hash))
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+tx_result_cache = TxResultCache()
+
+
+def normalize_hash(tx: str) -> str:
+    return tx[2:].upper() if tx.lower().startswith("0x") else tx.upper()
+
+
+def _decode_attribute(text):
+    """CometBFT before 0.37 base64-encodes event attributes; newer versions send them as is."""
+    if text is None:
+        return ""
+    try:
+        decoded = base64.b64decode(text, validate=True).decode()
+        if decoded.isprintable():
+            return decoded
+    except ValueError:
+        pass
+    return text
+
+
+def parse_events(tx_result: dict) -> list:
+    """Return (type, {key: value}) pairs with attribute keys and JSON-quoted values unwrapped."""
+    events = []
+    for event in tx_result.get("events") or []:
+        attributes = {}
+        for attribute in event.get("attributes") or []:
+            key = attribute.get("key") or ""
+            if not ATTRIBUTE_KEY_RE.match(key):
+                key = _decode_attribute(key)
+                value = _decode_attribute(attribute.get("value"))
+            else:
+                value = attribute.get("value") or ""
+            attributes[key] = value.strip('"')
+        events.append((event.get("type"), attributes))
+    return events
+
+
+def _read_varint(data: bytes, pos: int) -> tuple:
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def _protobuf_fields(data: bytes):
+    """Yield (field number, value) of the varint and length-delimited fields of a protobuf message."""
+    pos = 0
+    while pos < len(data):
+        key, pos = _read_varint(data, pos)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = _read_varint(data, pos)
+        elif wire_type == 2:
+            length, pos = _read_varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        elif wire_type in (1, 5):
+            pos += 8 if wire_type == 1 else 4
+            continue
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+        yield number, value
+
+
+def extract_memo(result: dict) -> str:
+    """Memo of a tx from its base64 TxRaw bytes (body_bytes = 1, TxBody.memo = 2); empty when unreadable."""
+    try:
+        raw = base64.b64decode(result.get("tx") or "")
+        for number, body in _protobuf_fields(raw):
+            if number == 1 and isinstance(body, bytes):
+                for field, value in _protobuf_fields(body):
+                    if field == 2 and isinstance(value, bytes):
+                        return value.decode()
+                return ""
+    except (ValueError, IndexError, UnicodeDecodeError):
+        pass
+    return ""
+
+
+def memo_binds_user(memo: str, telegram_id: str, chain: dict) -> bool:
+    encoded = encode_id(telegram_id)
+    return bool(encoded) and memo.endswith(f"{chain.get('memoVal', '')}{encoded}{chain.get('memoChain', '')}")
+
+
+def add_amounts(amounts: dict, text: str):
+    for part in (text or "").split(","):
+        match = AMOUNT_RE.match(part.strip())
+        if match:
+            amounts[match.group(2)] += int(match.group(1))
+
+
+def evaluate_tx(result: dict, telegram_id: str, address: str, chain: dict) -> tuple:
+    """Decide (status, amount, error) for a user's delegation from its committed tx."""
+    tx_result = result.get("tx_result") or {}
+    code = int(tx_result.get("code") or 0)
+    if code != 0:
+        return FAILED, None, f"tx failed with code {code}: {(tx_result.get('log') or '')[:200]}"
+    if not memo_binds_user(extract_memo(result), telegram_id, chain):
+        return FAILED, None, "tx memo does not reference this user"
+
+    granted = False
+    amounts = defaultdict(int)
+    for event_type, attributes in parse_events(tx_result):
+        if event_type == GRANT_EVENT:
+            if attributes.get("granter") == address and attributes.get("grantee") == chain.get("address"):
+                granted = True
+        elif event_type == "delegate":
+            if (attributes.get("validator") == chain.get("validatorValoper")
+                    and attributes.get("delegator", address) == address):
+                add_amounts(amounts, attributes.get("amount"))
+        elif event_type == "redelegate":
+            if attributes.get("destination_validator") == chain.get("validatorValoper"):
+                add_amounts(amounts, attributes.get("amount"))
+
+    amount = ",".join(f"{value}{denom}" for denom, value in sorted(amounts.items())) or None
+    if granted or amount:
+        return VERIFIED, amount, None
+    return FAILED, None, "tx does not grant or delegate to the validator from this address"
+
+
+async def fetch_txs(session: aiohttp.ClientSession, rpc_url: str, hashes: list) -> dict:
+    """Look up txs with one JSON-RPC batch call; unknown txs are missing from the result."""
+    payload = [
+        {"jsonrpc": "2.0", "id": index, "method": "tx",
+         "params": {"hash": base64.b64encode(bytes.fromhex(tx_hash)).decode(), "prove": False}}
+        for index, tx_hash in enumerate(hashes)
+    ]
+    async with session.post(rpc_url, json=payload) as response:
+        response.raise_for_status()
+        answers = await response.json(content_type=None)
+    if isinstance(answers, dict):
+        answers = [answers]
+    found = {}
+    for answer in answers:
+        result = answer.get("result")
+        if result is not None and isinstance(answer.get("id"), int) and answer["id"] < len(hashes):
+            found[hashes[answer["id"]]] = result
+    return found
+
+
+async def lookup_txs(session, rpc_url: str, hashes: list, semaphore: asyncio.Semaphore) -> dict:
+    results = {}
+    missing = []
+    for tx_hash in hashes:
+        cached = tx_result_cache.get(rpc_url, tx_hash)
+        if cached is not None:
+            results[tx_hash] = cached
+        else:
+            missing.append(tx_hash)
+
+    async def fetch_chunk(chunk):
+        async with semaphore:
+            try:
+                found = await fetch_txs(session, rpc_url, chunk)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                logger.warning(f"Tx lookup on {rpc_url} failed for {len(chunk)} txs: {e}")
+                return
+        for tx_hash, result in found.items():
+            tx_result_cache.put(rpc_url, tx_hash, result)
+            results[tx_hash] = result
+
+    await asyncio.gather(*(fetch_chunk(missing[start:start + TX_VERIFY_RPC_BATCH])
+                           for start in range(0, len(missing), TX_VERIFY_RPC_BATCH)))
+    return results
+
+
+async def record_results(outcomes: list):
+    if not outcomes:
+        return
+    columns = [list(column) for column in zip(*outcomes)]
+    await connections.get("default").execute_query(RECORD_RESULTS_SQL, columns)
+
+
+async def verify_pending(session: aiohttp.ClientSession, batch_size: int = TX_VERIFY_BATCH_SIZE) -> dict:
+    """Verify one batch of pending delegations and record the outcomes in one statement."""
+    now = datetime.now(timezone.utc)
+    rows = await Delegations.filter(verification_status=PENDING).filter(
+        Q(verification_checked_at__isnull=True)
+        | Q(verification_checked_at__lt=now - timedelta(seconds=TX_VERIFY_RETRY_INTERVAL))
+    ).order_by("updated_at").limit(batch_size).values(
+        "id", "telegram_id", "chain", "address", "tx", "verify_started_at", "updated_at")
+
+    outcomes = []
+    by_chain = defaultdict(list)
+    for row in rows:
+        chain = get_chain(row["chain"])
+        if not chain or not chain.get("rpcUrl"):
+            outcomes.append((row["id"], row["tx"], FAILED, None, f"No RPC endpoint for chain {row['chain']}"))
+        elif not TX_HASH_RE.match(row["tx"] or ""):
+            outcomes.append((row["id"], row["tx"], FAILED, None, "Malformed tx hash"))
+        else:
+            by_chain[row["chain"]].append(row)
+
+    semaphore = asyncio.Semaphore(TX_VERIFY_CONCURRENCY)
+    lookups = {
+        key: asyncio.ensure_future(lookup_txs(
+            session, get_chain(key)["rpcUrl"], sorted({normalize_hash(row["tx"]) for row in chain_rows}), semaphore))
+        for key, chain_rows in by_chain.items()
+    }
+    for key, chain_rows in by_chain.items():
+        results = await lookups[key]
+        chain = get_chain(key)
+        verified = set()
+        for row in chain_rows:
+            tx_hash = normalize_hash(row["tx"])
+            result = results.get(tx_hash)
+            if result is not None:
+                status, amount, error = evaluate_tx(result, row["telegram_id"], row["address"], chain)
+                if status == VERIFIED and tx_hash in verified:
+                    status, amount, error = FAILED, None, "tx already verified for another user"
+                elif status == VERIFIED:
+                    verified.add(tx_hash)
+                outcomes.append((row["id"], row["tx"], status, amount, error))
+            elif now - (row["verify_started_at"] or row["updated_at"]) > timedelta(seconds=TX_VERIFY_GIVE_UP_AFTER):
+                outcomes.append((row["id"], row["tx"], FAILED, None, "tx not found on chain"))
+            else:
+                outcomes.append((row["id"], row["tx"], PENDING, None, None))
+
+    await record_results(outcomes)
+    counts = defaultdict(int)
+    for outcome in outcomes:
+        counts[outcome[2]] += 1
+    if outcomes:
+        logger.info(f"Tx verification pass: {dict(counts)}")
+    return dict(counts)
+
+
+def create_session() -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(limit=TX_VERIFY_CONCURRENCY, ttl_dns_cache=300, keepalive_timeout=60)
+    return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=TX_VERIFY_TIMEOUT))
+
+
+async def run_tx_verifier():
+    async with create_session() as session:
+        while True:
+            try:
+                await verify_pending(session)
+            except Exception as e:
+                logger.error(f"Error verifying delegation txs: {e}")
+            await asyncio.sleep(TX_VERIFY_INTERVAL)
+
+
+async def main(once: bool):
+    await Tortoise.init(config=tortoise_config())
+    if once:
+        async with create_session() as session:
+            print(json.dumps(await verify_pending(session)))
+    else:
+        await run_tx_verifier()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Verify pending delegation txs on chain.")
+    parser.add_argument('--once', action='store_true', help="Run a single pass and exit")
+    setup_logging()
+    run_async(main(parser.parse_args().once))
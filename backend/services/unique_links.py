@@ -0,0 +1,76 @@
+import os
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from tortoise import connections
+from models.models import UniqueLinks
+
+logger = logging.getLogger(__name__)
+
+UNIQUE_LINK_TTL = timedelta(days=int(os.getenv('UNIQUE_LINK_TTL_DAYS', '30')))
+UNIQUE_LINK_PRUNE_INTERVAL = int(os.getenv('UNIQUE_LINK_PRUNE_INTERVAL', '3600'))
+
+CONSUME_LINK_SQL = """
+UPDATE unique_links AS l
+SET used = TRUE, used_at = now()
+FROM users AS u
+WHERE l.link_id = $1
+  AND l.telegram_id = $2
+  AND l.used = FALSE
+  AND l.expires_at > now()
+  AND u.telegram_id = l.telegram_id
+  AND u.ref_id = $3
+RETURNING l.link_id
+"""
+
+CONSUME_NONCE_SQL = """
+UPDATE unique_links
+SET used = TRUE, used_at = now()
+WHERE link_id = $1
+  AND telegram_id = $2
+  AND used = FALSE
+RETURNING link_id
+"""
+
+
+async def create_unique_link(link_id: str, telegram_id: str, expires_at: datetime = None, using_db=None):
+    return await UniqueLinks.create(
+        link_id=link_id,
+        telegram_id=telegram_id,
+        expires_at=expires_at or datetime.now(timezone.utc) + UNIQUE_LINK_TTL,
+        using_db=using_db,
+    )
+
+
+async def consume_unique_link(link_id: str, telegram_id: str, ref_id: str) -> bool:
+    """Mark a link as used if it is still unused, unexpired and belongs to the user.
+
+    Runs as one conditional UPDATE, so concurrent requests for the same link
+    cannot both succeed.
+    """
+    connection = connections.get("default")
+    rows = await connection.execute_query_dict(CONSUME_LINK_SQL, [link_id, telegram_id, ref_id])
+    return bool(rows)
+
+
+async def consume_link_nonce(nonce: str, telegram_id: str) -> bool:
+    """Single-use check for a signed link whose owner, referrer and expiry were already verified."""
+    connection = connections.get("default")
+    rows = await connection.execute_query_dict(CONSUME_NONCE_SQL, [nonce, telegram_id])
+    return bool(rows)
+
+
+async def prune_expired_links() -> int:
+    deleted = await UniqueLinks.filter(expires_at__lt=datetime.now(timezone.utc)).delete()
+    if deleted:
+        logger.info(f"Pruned {deleted} expired unique links.")
+    return deleted
+
+
+async def run_link_pruner():
+    while True:
+        try:
+            await prune_expired_links()
+        except Exception as e:
+            logger.error(f"Error pruning expired unique links: {e}")
+        await asyncio.sleep(UNIQUE_LINK_PRUNE_INTERVAL)
@@ -0,0 +1,71 @@
+import os
+import time
+import logging
+from collections import OrderedDict
+from services.metrics import CACHE_REQUESTS
+from models.models import Users
+
+logger = logging.getLogger(__name__)
+
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '60'))
+
+
+class UserCache:
+    """Read-through cache of Users rows keyed by telegram_id, with LRU eviction and a TTL.
+
+    Missing users are not cached, so a user created right after a miss is
+    found on the next lookup. Every code path that writes a Users row must
+    call invalidate() for it.
+    """
+
+    def __init__(self, maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def get(self, telegram_id: str):
+        telegram_id = str(telegram_id)
+        entry = self._entries.get(telegram_id)
+        if entry is not None:
+            user, expires_at = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(telegram_id)
+                self.hits += 1
+                CACHE_REQUESTS.labels("user", "hit").inc()
+                return user
+            del self._entries[telegram_id]
+
+        self.misses += 1
+        CACHE_REQUESTS.labels("user", "miss").inc()
+        user = await Users.get_or_none(telegram_id=telegram_id)
+        if user is not None:
+            self.put(user)
+        return user
+
+    def put(self, user):
+        self._entries[str(user.telegram_id)] = (user, time.monotonic() + self.ttl)
+        self._entries.move_to_end(str(user.telegram_id))
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, telegram_id: str):
+        self._entries.pop(str(telegram_id), None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+user_cache = UserCache()
@@ -1,28 +1,54 @@
+from datetime import datetime, timezone
 from fastapi import HTTPException
-from models.models import Users
+from models.models import UniqueLinks
+from services.unique_links import consume_unique_link, consume_link_nonce
+from services.link_tokens import verify_link_token, VALID, EXPIRED, LEGACY
+from services.user_cache import user_cache
 import logging
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+USED_MESSAGE = "This link has already been used. We have sent a new website link to the bot, please use it."
+EXPIRED_MESSAGE = "This link has expired. Please press /start in the bot to get a new one."
+
+
 async def validate_user_link(user_id: str, ref_id: str, link_id: str):
-    user = await Users.get_or_none(telegram_id=user_id)
+    status, nonce = verify_link_token(link_id, user_id, ref_id)
+    if status == LEGACY:
+        return await validate_legacy_link(user_id, ref_id, link_id)
+    if status == EXPIRED:
+        return {"valid": False, "message": EXPIRED_MESSAGE}
+    if status != VALID:
+        raise HTTPException(status_code=400, detail="Invalid link_id.")
+
+    if await consume_link_nonce(nonce, user_id):
+        return {"valid": True, "message": "Link is valid and has been used successfully."}
+    return {"valid": False, "message": USED_MESSAGE}
+
+
+async def validate_legacy_link(user_id: str, ref_id: str, link_id: str):
+    """Validate an unsigned uuid link issued before link tokens, entirely against the database."""
+    if await consume_unique_link(link_id, user_id, ref_id):
+        return {"valid": True, "message": "Link is valid and has been used successfully."}
+
+    user = await user_cache.get(user_id)
     if not user:
         logger.error("User not found.")
         raise HTTPException(status_code=404, detail="User not found.")
 
-    if ref_id not in user.ref_id:
+    if ref_id != user.ref_id:
         logger.error("Invalid ref_id.")
         raise HTTPException(status_code=400, detail="Invalid ref_id.")
 
-    if link_id not in user.used_unique_links:
+    link = await UniqueLinks.get_or_none(link_id=link_id, telegram_id=user_id)
+    if not link:
         raise HTTPException(status_code=400, detail="Invalid link_id.")
 
-    if user.used_unique_links[link_id]:
-        return {"valid": False,
-                "message": "This link has already been used. We have sent a new website link to the bot, please use it."}
-    else:
-        user.used_unique_links[link_id] = True
-        await user.save()
-        return {"valid": True, "message": "Link is valid and has been used successfully."}
+    if link.used:
+        return {"valid": False, "message": USED_MESSAGE}
+
+    if link.expires_at <= datetime.now(timezone.utc):
+        return {"valid": False, "message": EXPIRED_MESSAGE}
+
+    raise HTTPException(status_code=400, detail="Invalid link_id.")